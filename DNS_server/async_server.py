@@ -0,0 +1,118 @@
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from resources.cacher import Cacher
+from resources.rate_limiter import RCODE_REFUSED
+from dns_data import dns_packer
+from server import Package, Server, settings
+
+
+# Протокол asyncio: принимает датаграммы и передает их серверу
+class _DNSDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "AsyncServer"):
+        self._server = server
+
+    def datagram_received(self, data: bytes, addr):
+        self._server.handle_datagram(data, addr)
+
+
+# Сервер, обрабатывающий запросы конкурентно: пока идут обращения
+# к вышестоящим серверам, прием новых датаграмм не останавливается
+class AsyncServer(Server):
+    def __init__(self, cacher: Optional[Cacher] = None, reuse_port: bool = False, worker: int = 0):
+        super().__init__(cacher, reuse_port, worker)
+        self._max_in_flight = settings["max_in_flight"]
+        self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight)
+        self._loop = None
+        self._transport = None
+        self._in_flight = None
+        self._stopped = None
+        self._tasks = set()
+        self.shed_misses = 0  # промахи, отклоненные из-за переполненной очереди
+        self._metrics.add_collector("async", lambda: {"shed_misses": self.shed_misses})
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        self._stopped = asyncio.Event()
+        self._loop.add_signal_handler(signal.SIGINT, self._stopped.set)
+
+        self._transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _DNSDatagramProtocol(self), sock=self._server_socket
+        )
+        try:
+            await self._stopped.wait()
+        finally:
+            self._transport.close()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._close(None, None)
+
+    # Обрабатываем датаграмму: ответы из кэша отправляем сразу,
+    # промахи разрешаем в пуле потоков
+    def handle_datagram(self, request: bytes, address):
+        timer = self._metrics.start_request()
+        client = self._limiter.client_key(address[0])
+        if not self._limiter.allow_query(client):
+            return
+        try:
+            request_package = Package(request)
+            timer.lap("parse")
+            cached = self._lookup_cache(request_package)
+            timer.lap("cache")
+            response = self._get_cached_response(request_package, cached)
+            if response is None:
+                response = self._refuse_miss(request_package, cached, client)
+        except Exception as e:
+            print(e)
+            return
+
+        if response is None and self._is_overloaded():
+            self.shed_misses += 1
+            response = dns_packer.get_response(
+                request_package.header, request_package.questions, [], [], RCODE_REFUSED
+            )
+        if response is not None:
+            timer.lap("pack")
+            self._send(request_package, response, address, client, timer)
+            return
+
+        task = self._loop.create_task(
+            self._resolve(request_package, cached, address, client, timer)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # Все max_in_flight разрешений заняты и еще max_queued_misses промахов ждут своей
+    # очереди: новые промахи не копим (каждый держит задачу и разобранный запрос),
+    # а сразу отвечаем REFUSED, как при исчерпанном бюджете промахов клиента
+    def _is_overloaded(self) -> bool:
+        return len(self._tasks) >= self._max_in_flight + settings["max_queued_misses"]
+
+    # Разрешаем промах кэша, ограничивая число одновременных обращений
+    async def _resolve(self, request_package, cached: list, address, client, timer):
+        async with self._in_flight:
+            try:
+                response = await self._loop.run_in_executor(
+                    self._executor, self._build_response, request_package, cached
+                )
+            except Exception as e:
+                print(e)
+                return
+        timer.lap("resolve")
+        self._send(request_package, response, address, client, timer)
+
+    def _send(self, request_package, response: bytes, address, client, timer):
+        try:
+            response = self._udp_response(request_package, response, client)
+        except Exception as e:
+            print(e)
+            return
+        if response is not None:
+            self._transport.sendto(response, address)
+            timer.lap("send")
+        timer.finish()
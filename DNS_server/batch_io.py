@@ -0,0 +1,204 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+from typing import Dict, List, Tuple
+
+Address = Tuple[str, int]
+
+_MSG_WAITFORONE = 0x10000
+# место под один ответ в буфере пакетной отправки; большие ответы уходят по одному
+_SEND_SLOT_SIZE = 4096
+# sockaddr_in: семейство в порядке байт машины, порт и адрес — в сетевом
+_SOCKADDR_IN = struct.Struct("=H2s4s8x")
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+# Загружаем recvmmsg/sendmmsg из libc; их нет вне Linux
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.recvmmsg.argtypes = [
+            ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+        ]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+# размер и смещение длины датаграммы в массиве mmsghdr, чтобы читать длины без ctypes;
+# длину адреса ядро не меняет: у сокета AF_INET она всегда равна sizeof(sockaddr_in)
+_MMSGHDR_SIZE = ctypes.sizeof(_MMsgHdr)
+_MSG_LEN_OFFSET = _MMsgHdr.msg_len.offset
+_UINT = struct.Struct("=I")
+
+
+def _address_of(buffer: bytearray) -> int:
+    return ctypes.addressof((ctypes.c_char * len(buffer)).from_buffer(buffer))
+
+
+# Связываем i-е сообщение с i-м участком буфера data и i-м адресом из names
+def _fill_headers(msgs, iov, data: bytearray, names: bytearray):
+    data_address, names_address = _address_of(data), _address_of(names)
+    slot = len(data) // len(msgs)
+    for i in range(len(msgs)):
+        iov[i].iov_base = data_address + i * slot
+        iov[i].iov_len = slot
+        header = msgs[i].msg_hdr
+        header.msg_iov = ctypes.pointer(iov[i])
+        header.msg_iovlen = 1
+        header.msg_name = names_address + i * _SOCKADDR_IN.size
+        header.msg_namelen = _SOCKADDR_IN.size
+
+
+def _unpack_address(sockaddr: bytes) -> Address:
+    _, port, ip = _SOCKADDR_IN.unpack(sockaddr)
+    return socket.inet_ntoa(ip), int.from_bytes(port, "big")
+
+
+def _pack_address(address: Address) -> bytes:
+    ip, port = address
+    return _SOCKADDR_IN.pack(socket.AF_INET, port.to_bytes(2, "big"), socket.inet_aton(ip))
+
+
+# Пакетный прием и отправка датаграмм через recvmmsg/sendmmsg: один системный
+# вызов на пачку датаграмм. Датаграммы, адреса и заголовки лежат в заранее
+# выделенных непрерывных буферах; поля заголовков читаются и пишутся через
+# struct, а не через атрибуты ctypes, которые дороже самого системного вызова
+class MMsgBatchIO:
+    def __init__(self, sock: socket.socket, batch_size: int, buffer_size: int):
+        self._sock = sock
+        self._batch_size = batch_size
+        self._buffer_size = buffer_size
+        # разобранные и упакованные адреса клиентов: клиенты обычно повторяются
+        self._addresses: Dict[bytes, Address] = {}
+        self._sockaddrs: Dict[Address, bytes] = {}
+
+        self._recv_data = bytearray(batch_size * buffer_size)
+        self._recv_view = memoryview(self._recv_data)
+        self._recv_names = bytearray(batch_size * _SOCKADDR_IN.size)
+        self._recv_iov = (_IOVec * batch_size)()
+        self._recv_msgs = (_MMsgHdr * batch_size)()
+        self._recv_lengths = memoryview(self._recv_msgs).cast("B").cast("I")[
+            _MSG_LEN_OFFSET // _UINT.size::_MMSGHDR_SIZE // _UINT.size
+        ]
+        _fill_headers(self._recv_msgs, self._recv_iov, self._recv_data, self._recv_names)
+
+        self._send_data = bytearray(batch_size * _SEND_SLOT_SIZE)
+        self._send_names = bytearray(batch_size * _SOCKADDR_IN.size)
+        self._send_iov = (_IOVec * batch_size)()
+        self._send_msgs = (_MMsgHdr * batch_size)()
+        _fill_headers(self._send_msgs, self._send_iov, self._send_data, self._send_names)
+        # у каждой ячейки свой постоянный адрес, перед отправкой меняется только длина
+        self._send_lengths = memoryview(self._send_iov).cast("B").cast("N")[1::2]
+
+    # Ждем хотя бы одну датаграмму и забираем все, что уже пришло (до batch_size)
+    def receive(self) -> List[Tuple[bytes, Address]]:
+        count = _libc.recvmmsg(
+            self._sock.fileno(), self._recv_msgs, self._batch_size, _MSG_WAITFORONE, None
+        )
+        if count < 0:
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                return []
+            raise OSError(error, "recvmmsg failed")
+
+        # длины всех датаграмм читаем одним срезом с шагом по массиву заголовков
+        lengths = self._recv_lengths[:count].tolist()
+        names = bytes(self._recv_names[:count * _SOCKADDR_IN.size])
+        view, size, addresses = self._recv_view, self._buffer_size, self._addresses
+        batch = []
+        for i, length in enumerate(lengths):
+            name = names[i * _SOCKADDR_IN.size:(i + 1) * _SOCKADDR_IN.size]
+            address = addresses.get(name)
+            if address is None:
+                address = addresses[name] = _unpack_address(name)
+            batch.append((bytes(view[i * size:i * size + length]), address))
+        return batch
+
+    # Отправляем ответы одной пачкой; что не ушло через sendmmsg или не поместилось
+    # в ячейку буфера отправки, отправляем по одному
+    def send(self, replies: List[Tuple[bytes, Address]]):
+        data, names, lengths = self._send_data, self._send_names, self._send_lengths
+        sockaddrs = self._sockaddrs
+        for start in range(0, len(replies), self._batch_size):
+            batched = []
+            for reply in replies[start:start + self._batch_size]:
+                response, address = reply
+                if len(response) > _SEND_SLOT_SIZE:
+                    self._sock.sendto(response, address)
+                    continue
+                i = len(batched)
+                data[i * _SEND_SLOT_SIZE:i * _SEND_SLOT_SIZE + len(response)] = response
+                lengths[i] = len(response)
+                sockaddr = sockaddrs.get(address)
+                if sockaddr is None:
+                    sockaddr = sockaddrs[address] = _pack_address(address)
+                names[i * _SOCKADDR_IN.size:(i + 1) * _SOCKADDR_IN.size] = sockaddr
+                batched.append(reply)
+
+            sent = _libc.sendmmsg(self._sock.fileno(), self._send_msgs, len(batched), 0)
+            for response, address in batched[max(sent, 0):]:
+                self._sock.sendto(response, address)
+
+
+# Запасной вариант без recvmmsg: после блокирующего приема первой датаграммы
+# вычитываем остальные без ожидания в заранее выделенные буферы
+class RecvIntoBatchIO:
+    def __init__(self, sock: socket.socket, batch_size: int, buffer_size: int):
+        self._sock = sock
+        self._buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        # без MSG_DONTWAIT пачка состоит из одной датаграммы
+        self._dont_wait = getattr(socket, "MSG_DONTWAIT", None)
+
+    def receive(self) -> List[Tuple[bytes, Address]]:
+        batch = []
+        flags = 0
+        for view in self._views:
+            try:
+                size, address = self._sock.recvfrom_into(view, 0, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            batch.append((bytes(view[:size]), address))
+            if self._dont_wait is None:
+                break
+            flags = self._dont_wait
+        return batch
+
+    def send(self, replies: List[Tuple[bytes, Address]]):
+        for data, address in replies:
+            self._sock.sendto(data, address)
+
+
+# Пакетный ввод-вывод для сокета: recvmmsg/sendmmsg, если они доступны
+def get_batch_io(sock: socket.socket, batch_size: int, buffer_size: int):
+    if _libc is not None:
+        return MMsgBatchIO(sock, batch_size, buffer_size)
+    return RecvIntoBatchIO(sock, batch_size, buffer_size)
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from batch_io import Address, get_batch_io
+from resources.cacher import Cacher
+from server import Package, Server, settings
+
+
+# Сервер с пакетным вводом-выводом: за одно пробуждение забирает из сокета
+# все пришедшие датаграммы (recvmmsg или цикл recv_into), отвечает на попадания
+# в кэш и отправляет ответы одной пачкой (sendmmsg). Промахи кэша разрешаются
+# в пуле потоков и отправляются по мере готовности
+class BatchServer(Server):
+    def __init__(self, cacher: Optional[Cacher] = None, reuse_port: bool = False, worker: int = 0):
+        super().__init__(cacher, reuse_port, worker)
+        self._batch_io = get_batch_io(
+            self._server_socket, settings["batch_size"], settings["request_size"]
+        )
+        self._executor = ThreadPoolExecutor(max_workers=settings["max_in_flight"])
+
+    def run(self):
+        try:
+            while self._handle_flag:
+                replies, timers = [], []
+                for request, address in self._batch_io.receive():
+                    timer = self._metrics.start_request()
+                    response = self._handle_datagram(request, address, timer)
+                    if response is not None:
+                        replies.append((response, address))
+                        if timer.sampled:
+                            timers.append(timer)
+                if replies:
+                    self._batch_io.send(replies)
+                # время отправки пачки относим к каждому замеренному ответу из нее
+                for timer in timers:
+                    timer.lap("send")
+                    timer.finish()
+        except OSError:
+            # сокет закрыт обработчиком SIGINT
+            if self._handle_flag:
+                raise
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # Отвечаем из кэша или передаем промах в пул потоков; None — отвечать сейчас нечего
+    def _handle_datagram(self, request: bytes, address: Address, timer) -> Optional[bytes]:
+        client = self._limiter.client_key(address[0])
+        if not self._limiter.allow_query(client):
+            return None
+        try:
+            request_package = Package(request)
+            timer.lap("parse")
+            cached = self._lookup_cache(request_package)
+            timer.lap("cache")
+            response = self._get_cached_response(request_package, cached)
+            if response is None:
+                response = self._refuse_miss(request_package, cached, client)
+            if response is None:
+                self._executor.submit(self._resolve, request_package, cached, address, client, timer)
+                return None
+            timer.lap("pack")
+            # дополнительная секция запроса разбирается только здесь, при поиске OPT
+            return self._udp_response(request_package, response, client)
+        except Exception as e:
+            print(e)
+            return None
+
+    def _resolve(self, request_package, cached: List, address: Address, client, timer):
+        try:
+            response = self._build_response(request_package, cached)
+            timer.lap("resolve")
+            response = self._udp_response(request_package, response, client)
+            if response is not None:
+                self._server_socket.sendto(response, address)
+                timer.lap("send")
+            timer.finish()
+        except Exception as e:
+            print(e)
@@ -0,0 +1,84 @@
+# Сравнение хранения кэша на диске: прежний pickle всего списка записей
+# и снимок с журналом (CacheStore).
+# Запуск из папки DNS_server: python benchmarks/bench_cache_store.py
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.dns_data.data import DNSResourceRecord, QueryType  # noqa: E402
+from DNS_server.resources.cache_store import CacheStore  # noqa: E402
+from DNS_server.resources.cacher import Cacher  # noqa: E402
+
+
+def _fill(cacher: Cacher, count: int):
+    for i in range(count):
+        name = f"host{i}.example.com"
+        records = [
+            DNSResourceRecord(name, QueryType.A, 1, 300, 4, f"10.0.{i % 256}.{j}")
+            for j in range(2)
+        ]
+        cacher.add(name, QueryType.A, records)
+
+
+def _seconds(action) -> float:
+    started = time.perf_counter()
+    action()
+    return time.perf_counter() - started
+
+
+def main(sizes=(1000, 10000, 100000)):
+    print(
+        f"{'entries':>8}{'pickle dump':>14}{'pickle load':>14}"
+        f"{'snapshot':>12}{'load':>10}{'append/entry':>15}"
+    )
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.txt")
+            cacher = Cacher(path, 60, size * 2, 1 << 40, snapshot_period=3600)
+            _fill(cacher, size)
+            items = cacher._snapshot_items()
+
+            # прежний формат: весь кэш одним pickle
+            old_path = os.path.join(directory, "cache.pickle")
+
+            def dump():
+                with open(old_path, "wb") as file:
+                    pickle.dump(items, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            def load():
+                with open(old_path, "rb") as file:
+                    pickle.load(file)
+
+            dump_time = _seconds(dump)
+            load_time = _seconds(load)
+
+            store = CacheStore(path, 3600, 1 << 40, lambda: items)
+            snapshot_time = _seconds(store.snapshot)
+            store_load_time = _seconds(lambda: sum(1 for _ in store.load()))
+
+            # запись в журнал идет в фоновом потоке, меряем время до сброса на диск
+            store.start()
+            while store._journal is None:  # поток записи начинает со снимка
+                time.sleep(0.001)
+            started = time.perf_counter()
+            for key, entry in items:
+                store.append(key, entry)
+            while not store._queue.empty():
+                time.sleep(0.001)
+            append_time = (time.perf_counter() - started) / size
+
+            print(
+                f"{size:>8}{dump_time * 1e3:>11.1f} ms{load_time * 1e3:>11.1f} ms"
+                f"{snapshot_time * 1e3:>9.1f} ms{store_load_time * 1e3:>7.1f} ms"
+                f"{append_time * 1e6:>12.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Микробенчмарки горячего пути сервера: разбор пакетов, сборка ответов
+# в dns_packer и операции кэша (Cacher).
+# Запуск из папки DNS_server: python benchmarks/bench_micro.py
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.benchmarks.bench_parser import answer_response, client_query  # noqa: E402
+from DNS_server.dns_data import dns_packer  # noqa: E402
+from DNS_server.dns_data.data import DNSPackage, QueryType  # noqa: E402
+from DNS_server.dns_data.package_view import DNSPackageView  # noqa: E402
+from DNS_server.resources.cacher import Cacher  # noqa: E402
+
+
+def _report(name: str, action, number: int):
+    seconds = min(timeit.repeat(action, number=number, repeat=3))
+    print(f"{name:<44}{seconds / number * 1e6:>10.2f} us")
+
+
+def main(number: int = 20000):
+    query = client_query()
+    answer = answer_response()
+    request_package = DNSPackageView(query)
+    answer_package = DNSPackage(answer)
+    records = answer_package.answer_records
+    question = request_package.questions[0]
+    wire = dns_packer.pack_answers(question.q_name, records)
+
+    print(f"{'operation':<44}{'time':>13}")
+    _report("DNSPackage: client query", lambda: DNSPackage(query), number)
+    _report("DNSPackage: answer (4 A)", lambda: DNSPackage(answer), number)
+    _report("DNSPackageView: query, questions", lambda: DNSPackageView(query).questions, number)
+    _report(
+        "DNSPackageView: answer, all records",
+        lambda: DNSPackageView(answer).answer_records,
+        number,
+    )
+    _report(
+        "dns_packer.get_response (4 A)",
+        lambda: dns_packer.get_response(
+            request_package.header, request_package.questions, records
+        ),
+        number,
+    )
+    _report(
+        "dns_packer.pack_answers (4 A)",
+        lambda: dns_packer.pack_answers(question.q_name, records),
+        number,
+    )
+    _report(
+        "dns_packer.get_cached_response (4 A)",
+        lambda: dns_packer.get_cached_response(query, request_package.questions_end, wire, 10),
+        number,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        cacher = Cacher(os.path.join(directory, "cache.txt"), 60, number * 4, 1 << 40)
+        names = [f"host{i}.example.com" for i in range(number)]
+        iterator = iter(names * 3)
+        _report("Cacher.add", lambda: cacher.add(next(iterator), QueryType.A, records), number)
+        cacher.add(question.q_name, QueryType.A, records)
+        _report("Cacher.get (hit)", lambda: cacher.get(question.q_name, QueryType.A), number)
+        _report("Cacher.get (miss)", lambda: cacher.get("absent.example.com", QueryType.A), number)
+
+
+if __name__ == "__main__":
+    main()
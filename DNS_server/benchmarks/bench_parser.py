@@ -0,0 +1,91 @@
+# Сравнение ленивого DNSPackageView с DNSPackage на типичных пакетах.
+# Запуск из папки DNS_server: python benchmarks/bench_parser.py
+import os
+import struct
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.dns_data import dns_packer  # noqa: E402
+from DNS_server.dns_data.data import DNSPackage  # noqa: E402
+from DNS_server.dns_data.package_view import DNSPackageView  # noqa: E402
+
+
+def _name(name: str) -> bytes:
+    return dns_packer._pack_domain_name(name)[1]
+
+
+def _record(name: bytes, r_type: int, r_data: bytes, ttl: int = 300) -> bytes:
+    return name + struct.pack("!HHIH", r_type, 1, ttl, len(r_data)) + r_data
+
+
+# Запрос клиента с одним вопросом
+def client_query() -> bytes:
+    return dns_packer.get_request(0x1234, "www.example.com", 1, 1)
+
+
+# Ответ с несколькими A-записями, имена сжаты ссылкой на вопрос
+def answer_response() -> bytes:
+    question = _name("www.example.com") + struct.pack("!HH", 1, 1)
+    records = [_record(b"\xc0\x0c", 1, bytes([93, 184, 216, i])) for i in range(4)]
+    return struct.pack("!6H", 0x1234, 0x8180, 1, len(records), 0, 0) + question + b"".join(records)
+
+
+# Ответ-делегирование: 13 NS-записей в секции полномочий и их адреса (glue)
+def referral_response() -> bytes:
+    question = _name("www.example.com") + struct.pack("!HH", 1, 1)
+    package = bytearray(struct.pack("!6H", 0x1234, 0x8000, 1, 0, 13, 26) + question)
+    ns_offsets = []
+    for i in range(13):
+        r_data = bytes([1]) + bytes([ord("a") + i]) + _name("gtld-servers.net")
+        ns_offsets.append(len(package) + 12)
+        package += _record(b"\xc0\x18", 2, r_data, 172800)
+    for offset in ns_offsets:
+        pointer = struct.pack("!H", 0xC000 | offset)
+        package += _record(pointer, 1, bytes([192, 5, 6, 30]), 172800)
+        package += _record(pointer, 28, bytes(range(16)), 172800)
+    return bytes(package)
+
+
+def _header_and_question(parser, data: bytes):
+    package = parser(data)
+    return package.header.id, package.questions[0].q_name
+
+
+def _all_sections(parser, data: bytes):
+    package = parser(data)
+    return (
+        package.questions,
+        package.answer_records,
+        package.authoritative_records,
+        package.additional_records,
+    )
+
+
+def main(number: int = 20000):
+    packets = {
+        "client query": client_query(),
+        "answer (4 A)": answer_response(),
+        "referral (13 NS + glue)": referral_response(),
+    }
+    usages = {"header + question": _header_and_question, "all sections": _all_sections}
+
+    print(f"{'packet':<26}{'usage':<20}{'DNSPackage':>14}{'DNSPackageView':>16}{'speedup':>10}")
+    for packet_name, data in packets.items():
+        assert _all_sections(DNSPackage, data) == _all_sections(DNSPackageView, data)
+        for usage_name, usage in usages.items():
+            results = []
+            for parser in (DNSPackage, DNSPackageView):
+                seconds = timeit.timeit(lambda: usage(parser, data), number=number)
+                results.append(seconds / number * 1e6)
+            print(
+                f"{packet_name:<26}{usage_name:<20}"
+                f"{results[0]:>11.2f} us{results[1]:>13.2f} us{results[0] / results[1]:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
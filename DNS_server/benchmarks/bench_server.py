@@ -0,0 +1,174 @@
+# Сквозной бенчмарк без сети: запускаем заглушку вышестоящего сервера
+# (benchmarks/stub_upstream.py), сервер (main.py) с временными настройками,
+# указывающими на нее, и нагрузку из benchmarks/load_udp.py для каждого режима
+# serve_mode. Печатаем ответы в секунду, перцентили задержки и пиковую память сервера.
+# Запуск из папки DNS_server:
+#   python benchmarks/bench_server.py --modes sync,async,batch --miss-ratio 0.05 --latency 5
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.benchmarks import load_udp  # noqa: E402
+from DNS_server.dns_data import dns_packer  # noqa: E402
+
+_STARTUP_TIMEOUT = 15
+
+
+# Настройки сервера для прогона: все файлы во временной папке, ограничения
+# частоты и метрики выключены, вышестоящий сервер — заглушка
+def _write_config(directory: str, args, mode: str) -> str:
+    with open("resources/config.json", "r") as jsonfile:
+        config = json.load(jsonfile)
+    config.update(
+        root_server_ip="127.0.0.1",
+        root_server_port=args.stub_port,
+        server_ip="127.0.0.1",
+        server_port=args.port,
+        serve_mode=mode,
+        workers=args.workers,
+        cache_filepath=os.path.join(directory, "cache.txt"),
+        zone_filepath=os.path.join(directory, "zones.txt"),
+        rate_limit_enabled=False,
+        metrics_enabled=False,
+    )
+    path = os.path.join(directory, f"config-{mode}.json")
+    with open(path, "w") as jsonfile:
+        json.dump(config, jsonfile, indent=2)
+    return path
+
+
+# Ждем, пока сервер начнет отвечать
+def _wait_ready(address) -> bool:
+    request = dns_packer.get_request(0, "ready.bench.test", 1, 1)
+    deadline = time.monotonic() + _STARTUP_TIMEOUT
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.2)
+        while time.monotonic() < deadline:
+            sock.sendto(request, address)
+            try:
+                sock.recv(4096)
+                return True
+            except (socket.timeout, ConnectionRefusedError):
+                continue
+    return False
+
+
+# Процесс и все его потомки (воркеры пула и владелец кэша)
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/task/{child}/children") as children:
+                pids += [int(p) for p in children.read().split()]
+        except OSError:
+            pass
+    return pids
+
+
+# Пиковая память (VmHWM) процесса сервера и его потомков в МБ; None вне Linux
+def _peak_memory(pid: int) -> Optional[float]:
+    if not os.path.exists(f"/proc/{pid}/status"):
+        return None
+    total = 0
+    for child in _process_tree(pid):
+        try:
+            with open(f"/proc/{child}/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+def _bench_mode(directory: str, args, mode: str, names, weights) -> Optional[dict]:
+    # сервер импортирует модули с префиксом пакета DNS_server
+    python_path = os.pathsep.join(filter(None, [os.path.dirname(ROOT), os.environ.get("PYTHONPATH")]))
+    env = dict(
+        os.environ,
+        DNS_SERVER_CONFIG=_write_config(directory, args, mode),
+        PYTHONPATH=python_path,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "main.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    address = ("127.0.0.1", args.port)
+    try:
+        if not _wait_ready(address):
+            print(f"{mode}: server did not start")
+            return None
+        load_udp.warm_up(address, names)
+        stats = load_udp.run(address, names, weights, args.zone, args.miss_ratio,
+                             args.clients, args.window, args.duration)
+        stats["memory"] = _peak_memory(server.pid)
+        return stats
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end DNS server benchmark")
+    parser.add_argument("--modes", default="sync,async,batch")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5354)
+    parser.add_argument("--stub-port", type=int, default=5301)
+    parser.add_argument("--latency", type=float, default=5.0, help="upstream latency, ms")
+    parser.add_argument("--jitter", type=float, default=1.0, help="upstream jitter, ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="upstream loss fraction")
+    parser.add_argument("--answers", type=int, default=2, help="records per upstream answer")
+    parser.add_argument("--zone", default="bench.test")
+    parser.add_argument("--popular", type=int, default=10000)
+    parser.add_argument("--zipf", type=float, default=1.0)
+    parser.add_argument("--miss-ratio", type=float, default=0.0)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--window", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    stub = subprocess.Popen([
+        sys.executable, "benchmarks/stub_upstream.py",
+        "--port", str(args.stub_port),
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--loss", str(args.loss),
+        "--answers", str(args.answers),
+    ], stdout=subprocess.DEVNULL)
+    names, weights = load_udp.zipf_names(args.zone, args.popular, args.zipf)
+    print(
+        f"{'mode':<8}{'answers/s':>11}{'lost':>8}{'p50, ms':>10}{'p99, ms':>10}"
+        f"{'p999, ms':>10}{'peak RSS, MB':>14}"
+    )
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for mode in args.modes.split(","):
+                stats = _bench_mode(directory, args, mode, names, weights)
+                if stats is None:
+                    continue
+                memory = "n/a" if stats["memory"] is None else f"{stats['memory']:.1f}"
+                print(
+                    f"{mode:<8}{stats['qps']:>11.0f}{stats['lost']:>8}{stats['p50']:>10.3f}"
+                    f"{stats['p99']:>10.3f}{stats['p999']:>10.3f}{memory:>14}"
+                )
+    finally:
+        stub.send_signal(signal.SIGINT)
+        stub.wait()
+
+
+if __name__ == "__main__":
+    main()
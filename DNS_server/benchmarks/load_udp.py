@@ -0,0 +1,167 @@
+# Нагрузочный тест: несколько процессов-клиентов держат по window запросов
+# в полете, считают ответы в секунду и задержку каждого ответа (p50/p99/p999).
+# Имена берутся из списка --names или из --popular имен зоны --zone с частотами
+# по закону Ципфа (--zipf); доля --miss-ratio запросов приходится на новые имена,
+# которых нет в кэше. Сервер запускается отдельно, например:
+#   python main.py                      (serve_mode: sync, затем batch)
+#   python benchmarks/load_udp.py --port 53 --names example.com,example.org
+# Весь прогон без сети (сервер, заглушка вышестоящего сервера, нагрузка) —
+# python benchmarks/bench_server.py
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.dns_data import dns_packer  # noqa: E402
+
+# Сколько запросов заранее выбираем из распределения имен для каждого клиента
+_SCHEDULE_SIZE = 50000
+_TIMEOUT = 0.5
+
+
+def _request(name: str) -> bytes:
+    return dns_packer.get_request(0, name, 1, 1)
+
+
+# Имена популярной части нагрузки и их веса: вес имени ранга k равен 1 / k^s
+def zipf_names(zone: str, count: int, exponent: float):
+    names = [f"n{rank}.{zone}" for rank in range(count)]
+    weights = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+    return names, weights
+
+
+# Прогреваем кэш сервера: каждое имя один раз, не больше window запросов в полете
+def warm_up(address, names: List[str], window: int = 64):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(5)
+        for start in range(0, len(names), window):
+            chunk = names[start:start + window]
+            for name in chunk:
+                sock.sendto(_request(name), address)
+            for _ in chunk:
+                try:
+                    sock.recv(4096)
+                except socket.timeout:
+                    print(f"no answer while warming up {address}")
+                    break
+
+
+def _client(address, names, weights, miss_ratio: float, zone: str, window: int,
+            duration: float, results):
+    random.seed()
+    schedule = [_request(name) for name in random.choices(names, cum_weights=weights,
+                                                          k=_SCHEDULE_SIZE)]
+    misses = itertools.count()
+    prefix = f"m{os.getpid()}-"
+    latencies = []
+    lost = 0
+    sent: Dict[int, float] = {}
+    next_id = itertools.count()
+
+    def send(sock, position: int):
+        if miss_ratio and random.random() < miss_ratio:
+            request = _request(f"{prefix}{next(misses)}.{zone}")
+        else:
+            request = schedule[position % _SCHEDULE_SIZE]
+        r_id = next(next_id) & 0xFFFF
+        sent[r_id] = time.perf_counter()
+        sock.sendto(struct.pack("!H", r_id) + request[2:], address)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(_TIMEOUT)
+        position = 0
+        deadline = time.perf_counter() + duration
+        for position in range(window):
+            send(sock, position)
+        while time.perf_counter() < deadline:
+            try:
+                response = sock.recv(4096)
+            except socket.timeout:
+                # потерянные запросы восполняем, чтобы в полете снова было window
+                lost += len(sent)
+                sent.clear()
+                for _ in range(window):
+                    position += 1
+                    send(sock, position)
+                continue
+            started = sent.pop(struct.unpack_from("!H", response)[0], None)
+            if started is not None:
+                latencies.append(time.perf_counter() - started)
+            position += 1
+            send(sock, position)
+    results.put((latencies, lost))
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+# Прогон нагрузки; возвращаем ответы в секунду, потери и перцентили задержки в мс
+def run(address, names: List[str], weights: List[float], zone: str, miss_ratio: float,
+        clients: int, window: int, duration: float) -> Dict[str, float]:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_client,
+            args=(address, names, weights, miss_ratio, zone, window, duration, results),
+        )
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for client_latencies, _ in totals for latency in client_latencies)
+    return {
+        "qps": len(latencies) / duration,
+        "lost": sum(lost for _, lost in totals),
+        "p50": _percentile(latencies, 0.5) * 1000,
+        "p99": _percentile(latencies, 0.99) * 1000,
+        "p999": _percentile(latencies, 0.999) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP load generator for the DNS server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=53)
+    parser.add_argument("--names", default="", help="comma-separated names, equally likely")
+    parser.add_argument("--zone", default="bench.test", help="zone of generated names")
+    parser.add_argument("--popular", type=int, default=1000, help="generated names count")
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of popularity")
+    parser.add_argument("--miss-ratio", type=float, default=0.0, help="share of new names")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--window", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    address = (args.host, args.port)
+    if args.names:
+        names = args.names.split(",")
+        weights = list(range(1, len(names) + 1))
+    else:
+        names, weights = zipf_names(args.zone, args.popular, args.zipf)
+    warm_up(address, names)
+
+    stats = run(address, names, weights, args.zone, args.miss_ratio,
+                args.clients, args.window, args.duration)
+    print(
+        f"{stats['qps']:.0f} answers/s, {stats['lost']} lost (timeouts), latency "
+        f"p50 {stats['p50']:.3f} ms, p99 {stats['p99']:.3f} ms, p999 {stats['p999']:.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Локальный вышестоящий сервер для бенчмарков: авторитетно отвечает на любой вопрос,
+# поэтому сервер, у которого он указан как root_server_ip, разрешает имена без сети.
+# Задержка, потери и размер ответов настраиваются; имена, начинающиеся с «nx»,
+# не существуют (NXDOMAIN). Ответы, не помещающиеся в датаграмму, обрезаются
+# с флагом TC, а по TCP на том же порту отдаются целиком.
+# Запуск из папки DNS_server: python benchmarks/stub_upstream.py --port 5300 --latency 20
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(ROOT)]
+os.chdir(ROOT)
+
+from DNS_server.dns_data import dns_packer  # noqa: E402
+from DNS_server.dns_data.data import DNSResourceRecord, QueryType, SOAData  # noqa: E402
+from DNS_server.dns_data.package_view import DNSPackageView  # noqa: E402
+
+_CLASSIC_UDP_SIZE = 512
+_RCODE_NAME_ERROR = 3
+
+
+# Ответ на запрос: answers A- или AAAA-записей, для остальных типов NODATA
+def build_response(request: bytes, answers: int, ttl: int) -> bytes:
+    package = DNSPackageView(request)
+    question = package.questions[0]
+    soa = DNSResourceRecord(
+        question.q_name, QueryType.SOA, 1, ttl, 0,
+        SOAData("ns.stub", "hostmaster.stub", 1, 3600, 600, 86400, ttl),
+    )
+    if question.q_name.lower().startswith("nx"):
+        return dns_packer.get_response(
+            package.header, package.questions, [], [soa], _RCODE_NAME_ERROR
+        )
+
+    seed = hash(question.q_name.lower()) & 0xFFFF
+    if question.q_type == QueryType.A:
+        r_data = [f"10.{seed >> 8}.{seed & 0xFF}.{i % 256}" for i in range(answers)]
+    elif question.q_type == QueryType.AAAA:
+        r_data = [f"fd00::{seed:x}:{i:x}" for i in range(answers)]
+    else:
+        return dns_packer.get_response(package.header, package.questions, [], [soa])
+    records = [
+        DNSResourceRecord(question.q_name, question.q_type, 1, ttl, 0, data) for data in r_data
+    ]
+    return dns_packer.get_response(package.header, package.questions, records)
+
+
+# Ответ по UDP не больше размера, объявленного в EDNS0 (или 512 байт)
+def fit_datagram(request: bytes, response: bytes) -> bytes:
+    udp_size = dns_packer.get_edns_udp_size(DNSPackageView(request))
+    if udp_size is None:
+        return dns_packer.truncate_response(response, _CLASSIC_UDP_SIZE)
+    response = dns_packer.truncate_response(response, udp_size - dns_packer.OPT_SIZE)
+    return bytes(dns_packer.add_edns(response, udp_size))
+
+
+class _StubProtocol(asyncio.DatagramProtocol):
+    def __init__(self, args):
+        self._args = args
+        self._transport = None
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        self.queries += 1
+        if random.random() < self._args.loss:
+            return
+        try:
+            response = fit_datagram(data, build_response(data, self._args.answers, self._args.ttl))
+        except Exception as e:
+            print(e)
+            return
+        delay = _delay(self._args)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._transport.sendto, response, addr)
+        else:
+            self._transport.sendto(response, addr)
+
+
+def _delay(args) -> float:
+    return max(0.0, args.latency + random.uniform(-args.jitter, args.jitter)) / 1000
+
+
+async def _serve_tcp(args, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            (length,) = struct.unpack("!H", await reader.readexactly(2))
+            request = await reader.readexactly(length)
+            await asyncio.sleep(_delay(args))
+            response = build_response(request, args.answers, args.ttl)
+            writer.write(struct.pack("!H", len(response)) + response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _StubProtocol(args), local_addr=(args.host, args.port)
+    )
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_tcp(args, reader, writer), args.host, args.port
+    )
+    print(f"stub upstream on {args.host}:{args.port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+        server.close()
+        print(f"stub upstream answered {protocol.queries} queries", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub upstream DNS server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± ms added to latency")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of dropped queries")
+    parser.add_argument("--answers", type=int, default=2, help="records per answer")
+    parser.add_argument("--ttl", type=int, default=300)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+from .names import *
 from .data import *
+from .package_view import *
 from .dns_packer import *
+from .delegation import *
+from .upstream import *
 from .resolver_name import *
@@ -1,14 +1,26 @@
 import struct
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import List, Union
+
+from DNS_server.dns_data.names import name_from_wire
 
 
 class QueryType(int, Enum):
     A = 1
     NS = 2
+    CNAME = 5
+    SOA = 6
     PTR = 12
+    MX = 15
+    TXT = 16
     AAAA = 28
+    SRV = 33
+    OPT = 41  # псевдозапись EDNS0 (RFC 6891)
+
+
+# типы, данные которых — одно доменное имя
+NAME_TYPES = (QueryType.NS.value, QueryType.CNAME.value, QueryType.PTR.value)
 
 
 class QueryClass(int, Enum):
@@ -32,6 +44,34 @@ class DNSQuestion:
     q_class: QueryClass
 
 
+# данные SOA-записи (начало зоны полномочий)
+@dataclass
+class SOAData:
+    m_name: str  # первичный сервер зоны
+    r_name: str  # почтовый адрес администратора
+    serial: int
+    refresh: int
+    retry: int
+    expire: int
+    minimum: int  # время хранения отрицательных ответов (RFC 2308)
+
+
+# данные MX-записи (почтовый сервер домена)
+@dataclass
+class MXData:
+    preference: int  # приоритет, меньшее значение предпочтительнее
+    exchange: str  # имя почтового сервера
+
+
+# данные SRV-записи (расположение сервиса, RFC 2782)
+@dataclass
+class SRVData:
+    priority: int
+    weight: int
+    port: int
+    target: str  # имя узла, предоставляющего сервис
+
+
 # класс с полями ресурса ДНС (последние три поля в пакете ДНС)
 @dataclass
 class DNSResourceRecord:
@@ -40,7 +80,9 @@ class DNSResourceRecord:
     r_class: QueryClass
     r_ttl: int  # время жизни пакета
     rd_length: int  # длина данных
-    r_data: str  # данные
+    # данные: строка для адресов и имен, список строк для TXT, разобранная структура
+    # для SOA, MX и SRV; данные остальных типов хранятся как есть (RFC 3597)
+    r_data: Union[str, SOAData, MXData, SRVData, List[bytes], bytes]
 
 
 # класс со структурой всего пакета ДНС
@@ -50,6 +92,7 @@ class DNSPackage:
     _pointer: int = 0
     header: DNSHeader = None
     questions: List[DNSQuestion] = None
+    questions_end: int = None  # смещение конца секции вопросов
     answer_records: List[DNSResourceRecord] = None
     authoritative_records: List[DNSResourceRecord] = None
     additional_records: List[DNSResourceRecord] = None
@@ -82,6 +125,7 @@ class DNSPackage:
                 )
             )
             self._pointer += step
+        self.questions_end = self._pointer
 
     # считываем ресурсные записи
     def _init_resource_records(self):
@@ -108,7 +152,7 @@ class DNSPackage:
     # считываем имя домена
     def _parse_name(self):
         name_list = []
-        position = self._pointer
+        start = segment = position = self._pointer
         flag = False
         while True:
             # если значение байта больше 63, то он указывает смещение на другую позицию в сообщении
@@ -117,6 +161,10 @@ class DNSPackage:
                     self._pointer = position + 2
                     flag = True
                 position = ((self.data[position] - 192) << 8) + self.data[position + 1]
+                # указатель должен вести раньше уже прочитанной части имени, иначе имя зациклится
+                if position >= segment:
+                    raise Exception("Invalid name compression pointer")
+                segment = position
                 continue
             # иначе началась следующая часть сообщения длины меньше либо равной 63 байт
             else:
@@ -124,6 +172,8 @@ class DNSPackage:
                 if length == 0:
                     if not flag:
                         self._pointer = position + 1
+                        # имя без сжатия берем из общей таблицы имен
+                        return name_from_wire(bytes(self.data[start: self._pointer]))
                     break
                 position += 1
                 name_list.append(self.data[position: position + length])
@@ -140,8 +190,17 @@ class DNSPackage:
             )
             data = ".".join(str(octet) for octet in ipv4_address)
             self._pointer += rd_length
-        elif r_type == QueryType.NS.value or r_type == QueryType.PTR.value:
+        elif r_type in NAME_TYPES:
             data = self._parse_name()
+        elif r_type == QueryType.SOA.value:
+            m_name = self._parse_name()
+            r_name = self._parse_name()
+            data = SOAData(
+                m_name,
+                r_name,
+                *struct.unpack("!5I", self.data[self._pointer: self._pointer + 20]),
+            )
+            self._pointer += 20
         elif r_type == QueryType.AAAA.value:
             ipv6_address = struct.unpack(
                 f"!{rd_length // 2}H",
@@ -149,6 +208,34 @@ class DNSPackage:
             )
             data = ":".join(str(hex(octet))[2:] for octet in ipv6_address)
             self._pointer += rd_length
+        elif r_type == QueryType.MX.value:
+            (preference,) = struct.unpack("!H", self.data[self._pointer: self._pointer + 2])
+            self._pointer += 2
+            data = MXData(preference, self._parse_name())
+        elif r_type == QueryType.SRV.value:
+            priority, weight, port = struct.unpack(
+                "!3H", self.data[self._pointer: self._pointer + 6]
+            )
+            self._pointer += 6
+            data = SRVData(priority, weight, port, self._parse_name())
+        elif r_type == QueryType.TXT.value:
+            data = parse_character_strings(
+                self.data, self._pointer, self._pointer + rd_length
+            )
+            self._pointer += rd_length
         else:
-            raise Exception(f"Unsupported query type={r_type}")
+            # данные неизвестных типов и параметры EDNS0 храним как есть
+            # и передаем клиенту без изменений
+            data = bytes(self.data[self._pointer: self._pointer + rd_length])
+            self._pointer += rd_length
         return data
+
+
+# Разбираем данные TXT-записи: последовательность строк, каждая со своей длиной впереди
+def parse_character_strings(data: bytes, start: int, end: int) -> List[bytes]:
+    strings = []
+    while start < end:
+        length = data[start]
+        strings.append(bytes(data[start + 1: start + 1 + length]))
+        start += length + 1
+    return strings
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional
+
+from DNS_server.dns_data.data import DNSResourceRecord, QueryType
+from DNS_server.dns_data.names import canonical_name
+
+
+# Делегирование зоны: ее NS-серверы и известные адреса этих серверов
+@dataclass
+class Delegation:
+    zone: str  # имя зоны, "" — корень
+    servers: List[str]  # имена NS-серверов зоны
+    addresses: Dict[str, List[str]]  # адреса серверов из glue-записей или разрешенные отдельно
+    expires: float  # время, когда истекает самая короткая TTL записей
+
+    # Все известные адреса серверов зоны
+    def ips(self) -> List[str]:
+        return [ip for server in self.servers for ip in self.addresses.get(server, ())]
+
+
+# Кэш делегирований (границ зон): для зоны хранит NS-серверы и их адреса, пока
+# не истечет TTL, поэтому разрешение начинается с ближайшей известной зоны,
+# а не с корневого сервера. При переполнении вытесняются давно не использованные зоны
+class DelegationCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._zones: "OrderedDict[str, Delegation]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Ближайшая к имени известная зона (само имя или его предок)
+    def closest(self, name: str) -> Optional[Delegation]:
+        labels = canonical_name(name).split(".")
+        now = time.time()
+        with self._lock:
+            for i in range(len(labels)):
+                zone = ".".join(labels[i:])
+                delegation = self._zones.get(zone)
+                if delegation is None:
+                    continue
+                if delegation.expires <= now:
+                    del self._zones[zone]
+                    continue
+                self._zones.move_to_end(zone)
+                self.hits += 1
+                return delegation
+            self.misses += 1
+            return None
+
+    # Запоминаем делегирование из ответа-направления: NS-записи из секции
+    # полномочий и их адреса из дополнительной секции
+    def add(
+            self,
+            ns_records: List[DNSResourceRecord],
+            additional_records: List[DNSResourceRecord],
+    ) -> Delegation:
+        zone = canonical_name(ns_records[0].r_name)
+        servers = [canonical_name(ns.r_data) for ns in ns_records]
+        addresses: Dict[str, List[str]] = {}
+        ttl = min(ns.r_ttl for ns in ns_records)
+        for ad_r in additional_records:
+            server = canonical_name(ad_r.r_name)
+            if ad_r.r_type == QueryType.A and server in servers:
+                addresses.setdefault(server, []).append(ad_r.r_data)
+                ttl = min(ttl, ad_r.r_ttl)
+
+        delegation = Delegation(zone, servers, addresses, time.time() + ttl)
+        if ttl > 0:
+            with self._lock:
+                self._zones[zone] = delegation
+                self._zones.move_to_end(zone)
+                while len(self._zones) > self.max_entries:
+                    self._zones.popitem(last=False)
+        return delegation
+
+    # Меняем ограничение числа зон; лишние давно не использованные зоны вытесняются
+    def resize(self, max_entries: int):
+        with self._lock:
+            self.max_entries = max_entries
+            while len(self._zones) > max_entries:
+                self._zones.popitem(last=False)
+
+    # Запоминаем адреса сервера зоны, которые пришлось разрешать отдельно (нет glue)
+    def add_addresses(self, delegation: Delegation, server: str, ips: List[str]):
+        with self._lock:
+            delegation.addresses = {**delegation.addresses, server: ips}
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"zones": len(self._zones), "hits": self.hits, "misses": self.misses}
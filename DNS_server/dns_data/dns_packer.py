@@ -1,86 +1,252 @@
+import socket
 import struct
-from typing import List, Tuple
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 from DNS_server.dns_data.data import (
     DNSHeader,
     DNSQuestion,
     DNSResourceRecord,
+    NAME_TYPES,
     QueryClass,
     QueryType,
 )
+from DNS_server.dns_data.names import fold_case
 
+_HEADER = struct.Struct("!6H")
+_QUESTION = struct.Struct("!HH")
+_RECORD = struct.Struct("!HHI")
+_POINTER = struct.Struct("!H")
+_SOA_TIMERS = struct.Struct("!5I")
+_MX_PREFERENCE = struct.Struct("!H")
+_SRV_FIELDS = struct.Struct("!3H")
+# запись OPT: корневое имя, тип, размер датаграммы, расширенный RCODE и флаги, длина данных
+_OPT = struct.Struct("!BHHIH")
+OPT_SIZE = _OPT.size
 
-# Упаковываем пакет в ответ на неверный запрос (QR=1 (ответное сообщение),
-# RCODE=2 (не реализовано), остальные флаги = 0))
-def get_unsupported_response(h_id: bytes) -> bytes:
-    return h_id + struct.pack(
-        "!5H",
-        *[
-            (2 << 14) + (2 << 9) + (2 << 2),
-            0,
-            0,
-            0,
-            0,
-        ],
-    )
+# размер ответа по UDP для клиентов без EDNS0 (RFC 1035, 4.2.1)
+_CLASSIC_UDP_SIZE = 512
 
+# флаг TC: ответ обрезан и не поместился в датаграмму
+FLAG_TC = 1 << 9
 
-# Собираем ответный пакет на разрешимый запрос в виде байтов
+
+# Собираем ответный пакет на разрешимый запрос в виде байтов.
+# Для отрицательного ответа передаем код ответа и SOA-запись в секции полномочий
 def get_response(
         req_header: DNSHeader,
         req_questions: List[DNSQuestion],
         res_answer_records: List[DNSResourceRecord],
+        res_authority_records: List[DNSResourceRecord] = (),
+        rcode: int = 0,
 ) -> bytes:
-    package = struct.pack(
-        "!6H",
-        *[
+    return bytes(
+        get_combined_response(
+            req_header, req_questions, (res_answer_records,), res_authority_records, rcode
+        )
+    )
+
+
+# Собираем ответ на запрос с несколькими вопросами за один проход: записи ответа
+# на каждый вопрос сразу дописываются в пакет, без объединения списков, а число
+# записей в заголовке проставляется в конце
+def get_combined_response(
+        req_header: DNSHeader,
+        req_questions: List[DNSQuestion],
+        answer_groups: Iterable[List[DNSResourceRecord]],
+        res_authority_records: List[DNSResourceRecord] = (),
+        rcode: int = 0,
+) -> bytearray:
+    package = bytearray(
+        _HEADER.pack(
             req_header.id,
-            (2 << 14) + (2 << 9),
+            (2 << 14) + (2 << 9) + rcode,
             len(req_questions),
-            len(res_answer_records),
             0,
+            len(res_authority_records),
             0,
-        ],
+        )
     )
+    offsets = {}
 
     for question in req_questions:
-        package += _pack_domain_name(question.q_name)[1] + struct.pack(
-            "!HH", *[question.q_type, question.q_class]
-        )
+        _write_name(package, question.q_name, offsets)
+        package += _QUESTION.pack(question.q_type, question.q_class)
 
-    for answer in res_answer_records:
-        package += (
-                _pack_domain_name(answer.r_name)[1]
-                + struct.pack("!HHI", answer.r_type, answer.r_class, answer.r_ttl)
-                + _pack_r_data(answer.r_type, answer.rd_length, answer.r_data)
-        )
+    an_count = 0
+    for records in answer_groups:
+        _write_records(package, records, offsets)
+        an_count += len(records)
+    _write_records(package, res_authority_records, offsets)
+    struct.pack_into("!H", package, 6, an_count)
+    return package
+
+
+# Упакованная секция ответов, которая хранится в кэше рядом с записями
+@dataclass
+class WireAnswers:
+    data: bytes  # записи в формате пакета
+    count: int  # количество записей
+    ttl_offsets: List[int]  # смещения полей TTL внутри data
+    ttls: List[int]  # исходные TTL записей
+    questions_end: int  # конец секции вопросов, на который рассчитаны указатели сжатия
+    authority_count: int = 0  # количество записей полномочий (SOA отрицательного ответа)
+    rcode: int = 0  # код ответа
+
+
+# Один раз упаковываем записи ответа, чтобы попадание в кэш не собирало их заново.
+# Имена в записях сжимаются ссылками на вопрос, поэтому упакованные записи годятся
+# для любого запроса с тем же единственным вопросом
+def pack_answers(
+        q_name: str,
+        res_answer_records: List[DNSResourceRecord],
+        res_authority_records: List[DNSResourceRecord] = (),
+        rcode: int = 0,
+) -> WireAnswers:
+    package = bytearray(_HEADER.size)
+    offsets = {}
+    _write_name(package, q_name, offsets)
+    package += bytes(_QUESTION.size)
+    questions_end = len(package)
+
+    ttl_offsets = _write_records(package, res_answer_records, offsets)
+    ttl_offsets += _write_records(package, res_authority_records, offsets)
+    return WireAnswers(
+        bytes(package[questions_end:]),
+        len(res_answer_records),
+        [ttl_offset - questions_end for ttl_offset in ttl_offsets],
+        [record.r_ttl for record in [*res_answer_records, *res_authority_records]],
+        questions_end,
+        len(res_authority_records),
+        rcode,
+    )
 
+
+# Собираем ответ из кэша: копируем вопрос из запроса, подставляем упакованные
+# записи и уменьшаем их TTL на время, прошедшее с момента кэширования
+# (но не ниже min_ttl — так истекшие записи отдаются с небольшим TTL).
+# Ответ собирается в новом буфере точного размера, а не в заранее выделенном
+# буфере потока: пакетный сервер копит ответы до sendmmsg, а TCP и EDNS0
+# держат или копируют ответ после возврата, так что общий буфер пришлось бы
+# копировать еще раз. Выделение (~0.1 мкс) дешевле лишней копии
+def get_cached_response(
+        request: bytes, questions_end: int, answers: WireAnswers, elapsed: int, min_ttl: int = 0
+) -> bytearray:
+    package = bytearray(questions_end + len(answers.data))
+    package[:2] = request[:2]
+    struct.pack_into(
+        "!5H",
+        package,
+        2,
+        (2 << 14) + (2 << 9) + answers.rcode,
+        1,
+        answers.count,
+        answers.authority_count,
+        0,
+    )
+    package[12:questions_end] = request[12:questions_end]
+    package[questions_end:] = answers.data
+    for ttl_offset, ttl in zip(answers.ttl_offsets, answers.ttls):
+        struct.pack_into("!I", package, questions_end + ttl_offset, max(ttl - elapsed, min_ttl))
     return package
 
 
-# По требуемому типу ответа собираем пакет с данными
-def _pack_r_data(r_type, rd_length, r_data) -> bytes:
+# Ответ, который не помещается в датаграмму размера max_size: оставляем заголовок
+# с флагом TC и вопросы, записи отбрасываем — клиент повторит запрос по TCP
+def truncate_response(response: bytes, max_size: int) -> bytes:
+    if len(response) <= max_size:
+        return response
+    h_id, flags, qd_count = struct.unpack_from("!3H", response)
+    position = _HEADER.size
+    for _ in range(qd_count):
+        position = _skip_name(response, position) + _QUESTION.size
+    return _HEADER.pack(h_id, flags | FLAG_TC, qd_count, 0, 0, 0) + bytes(
+        response[_HEADER.size:position]
+    )
+
+
+# Смещение сразу за именем, начинающимся с position (имя может заканчиваться указателем)
+def _skip_name(package: bytes, position: int) -> int:
+    while True:
+        length = package[position]
+        if length == 0:
+            return position + 1
+        if length > 63:
+            return position + _POINTER.size
+        position += length + 1
+
+
+# Дописываем ресурсные записи в пакет, возвращаем смещения их полей TTL
+def _write_records(
+        package: bytearray, records: List[DNSResourceRecord], offsets: Dict[str, int]
+) -> List[int]:
+    ttl_offsets = []
+    for answer in records:
+        _write_name(package, answer.r_name, offsets)
+        ttl_offsets.append(len(package) + 4)
+        package += _RECORD.pack(answer.r_type, answer.r_class, answer.r_ttl)
+        # длину данных записываем после того, как данные упакованы
+        rd_length_offset = len(package)
+        package += b"\0\0"
+        _write_r_data(package, answer.r_type, answer.r_data, offsets)
+        struct.pack_into("!H", package, rd_length_offset, len(package) - rd_length_offset - 2)
+    return ttl_offsets
+
+
+# По требуемому типу ответа дописываем в пакет данные записи
+def _write_r_data(package: bytearray, r_type, r_data, offsets: Dict[str, int]):
     if r_type == QueryType.A.value:
-        data = struct.pack(f"!H{rd_length}B", 4, *map(int, r_data.split(".")))
-    elif r_type == QueryType.NS.value or r_type == QueryType.PTR.value:
-        rd_length, data = _pack_domain_name(r_data)
-        data = struct.pack("!H", rd_length) + data
+        package += socket.inet_aton(r_data)
+    elif r_type in NAME_TYPES:
+        _write_name(package, r_data, offsets)
+    elif r_type == QueryType.SOA.value:
+        _write_name(package, r_data.m_name, offsets)
+        _write_name(package, r_data.r_name, offsets)
+        package += _SOA_TIMERS.pack(
+            r_data.serial, r_data.refresh, r_data.retry, r_data.expire, r_data.minimum
+        )
     elif r_type == QueryType.AAAA.value:
-        octets = [int(octet, 16) for octet in r_data.split(":")]
-        data = struct.pack(f"!H{rd_length // 2}H", 16, *octets)
+        package += socket.inet_pton(socket.AF_INET6, r_data)
+    elif r_type == QueryType.MX.value:
+        package += _MX_PREFERENCE.pack(r_data.preference)
+        _write_name(package, r_data.exchange, offsets)
+    elif r_type == QueryType.SRV.value:
+        package += _SRV_FIELDS.pack(r_data.priority, r_data.weight, r_data.port)
+        # имя в SRV не сжимается (RFC 2782)
+        _write_name(package, r_data.target, {})
+    elif r_type == QueryType.TXT.value:
+        for string in r_data:
+            package.append(len(string))
+            package += string
     else:
-        raise Exception(f"Unsupported query type={r_type}")
-    return data
+        # данные неизвестного типа передаем без изменений: сжатие имен в них
+        # запрещено (RFC 3597), поэтому они не зависят от положения в пакете
+        package += r_data
+
+
+# Дописываем доменное имя в пакет. Если такой же суффикс имени уже есть в пакете,
+# вместо него пишем указатель на него (сжатие имен, RFC 1035, 4.1.4).
+# offsets хранит смещения всех записанных суффиксов
+def _write_name(package: bytearray, domain_name: str, offsets: Dict[str, int]):
+    labels = domain_name.split(".") if domain_name else []
+    for i in range(len(labels)):
+        suffix = fold_case(".".join(labels[i:]))
+        if (pointer := offsets.get(suffix)) is not None:
+            package += _POINTER.pack(0xC000 | pointer)
+            return
+        # указатель может адресовать только первые 16 КБ пакета
+        if len(package) < 0x4000:
+            offsets[suffix] = len(package)
+        label = labels[i].encode()
+        package.append(len(label))
+        package += label
+    package.append(0)
 
 
 # Упаковываем представление доменного имени
 def _pack_domain_name(domain_name: str) -> Tuple[int, bytes]:
-    package = bytes()
-    labels = [(len(name), name) for name in domain_name.split(".")]
-
-    for label in labels:
-        package += struct.pack(f"!B", label[0]) + label[1].encode()
-    package += struct.pack("!B", 0)
-    return len(labels) + sum([label[0] for label in labels]) + 1, package
+    package = bytearray()
+    _write_name(package, domain_name, {})
+    return len(package), bytes(package)
 
 
 # Формируем вопрос (в случае, если в кэше не было ответа и нужно обратиться к ДНС серверу)
@@ -89,11 +255,32 @@ def _pack_question(q_data: str, q_type: QueryType, q_class: QueryClass) -> bytes
     return data + struct.pack("!2H", *[q_type, q_class])
 
 
-# Формируем запрос к ДНС серверу
+# Формируем запрос к ДНС серверу. Если задан udp_size, добавляем запись OPT:
+# сервер сможет ответить датаграммой такого размера, не обрезая ответ
 def get_request(
-        r_id: int, domain_name: str, q_type: QueryType, q_class: QueryClass
+        r_id: int, domain_name: str, q_type: QueryType, q_class: QueryClass, udp_size: int = 0
 ) -> bytes:
-    return struct.pack(
+    request = struct.pack(
         "!6H",
-        *[r_id, 0, 1, 0, 0, 0],
+        *[r_id, 0, 1, 0, 0, 1 if udp_size else 0],
     ) + _pack_question(q_data=domain_name, q_type=q_type, q_class=q_class)
+    if udp_size:
+        request += _OPT.pack(0, QueryType.OPT, udp_size, 0, 0)
+    return request
+
+
+# Размер датаграммы, который клиент объявил в записи OPT; None, если клиент не использует EDNS0
+def get_edns_udp_size(package) -> Optional[int]:
+    for record in package.additional_records:
+        if record.r_type == QueryType.OPT:
+            return max(record.r_class, _CLASSIC_UDP_SIZE)
+    return None
+
+
+# Добавляем в ответ запись OPT с размером датаграмм, которые принимаем сами
+def add_edns(response: bytes, udp_size: int) -> bytearray:
+    package = bytearray(response)
+    (ar_count,) = struct.unpack_from("!H", package, 10)
+    struct.pack_into("!H", package, 10, ar_count + 1)
+    package += _OPT.pack(0, QueryType.OPT, udp_size, 0, 0)
+    return package
@@ -0,0 +1,52 @@
+from typing import Dict
+
+# Сколько имен помним в каждой таблице; переполненная таблица очищается целиком,
+# чтобы поток случайных имен не занимал память и не вытеснял популярные навсегда
+_MAX_NAMES = 65536
+
+# имя в формате пакета (без сжатия) → строка имени
+_wire_names: Dict[bytes, str] = {}
+# строка имени → каноническое имя
+_canonical_names: Dict[str, str] = {}
+
+# Регистр в DNS не различается только у латинских букв (RFC 4343): метки читаются
+# как cp1251, и str.lower() склеил бы разные байты кириллицы в один ключ
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+# Имя по его записи в пакете (метки с длинами, без сжатия). Одно и то же имя
+# из разных пакетов декодируется один раз и дальше возвращается тем же объектом
+# строки, у которого хэш уже посчитан
+def name_from_wire(wire: bytes) -> str:
+    name = _wire_names.get(wire)
+    if name is None:
+        labels = []
+        position = 0
+        while wire[position]:
+            length = wire[position]
+            labels.append(wire[position + 1: position + 1 + length].decode("cp1251"))
+            position += length + 1
+        name = ".".join(labels)
+        if len(_wire_names) >= _MAX_NAMES:
+            _wire_names.clear()
+        _wire_names[wire] = name
+    return name
+
+
+# Каноническое имя: латиница в нижнем регистре, и в единственном экземпляре, поэтому
+# "Example.COM" и "example.com" дают один ключ кэша, зон и делегирований,
+# а поиск по нему не строит новую строку и не считает хэш заново
+def canonical_name(name: str) -> str:
+    canonical = _canonical_names.get(name)
+    if canonical is None:
+        if len(_canonical_names) >= _MAX_NAMES:
+            _canonical_names.clear()
+        lowered = fold_case(name)
+        canonical = _canonical_names.setdefault(lowered, lowered)
+        _canonical_names[name] = canonical
+    return canonical
+
+
+# Имя в нижнем регистре без учета регистра не латинских букв
+def fold_case(name: str) -> str:
+    return name.translate(_ASCII_LOWER)
@@ -0,0 +1,157 @@
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from DNS_server.dns_data.data import (
+    DNSHeader,
+    DNSQuestion,
+    DNSResourceRecord,
+    MXData,
+    NAME_TYPES,
+    QueryType,
+    SOAData,
+    SRVData,
+    parse_character_strings,
+)
+from DNS_server.dns_data.names import name_from_wire
+
+_HEADER = struct.Struct("!6H")
+_QUESTION = struct.Struct("!HH")
+_RECORD = struct.Struct("!HHIH")
+_SOA_TIMERS = struct.Struct("!5I")
+_MX_PREFERENCE = struct.Struct("!H")
+_SRV_FIELDS = struct.Struct("!3H")
+# имя не длиннее 255 байт, поэтому в нем не больше 127 переходов по указателям
+_MAX_NAME_POINTERS = 127
+
+
+# Ленивый разбор пакета ДНС поверх memoryview: заголовок читается сразу,
+# вопросы и ресурсные записи — при первом обращении к ним. Данные не копируются,
+# а уже разобранные имена запоминаются по смещению, поэтому повторяющиеся
+# (сжатые) имена декодируются один раз
+class DNSPackageView:
+    def __init__(self, data: bytes):
+        self.data = data
+        self._view = memoryview(data)
+        self.header = DNSHeader(*_HEADER.unpack_from(data))
+        self._names: Dict[int, Tuple[str, int]] = {}
+        self._questions: Optional[List[DNSQuestion]] = None
+        self._questions_end = 0
+        self._sections: List[List[DNSResourceRecord]] = []
+        self._sections_end = 0
+
+    @property
+    def questions(self) -> List[DNSQuestion]:
+        if self._questions is None:
+            self._parse_questions()
+        return self._questions
+
+    @property
+    def questions_end(self) -> int:
+        if self._questions is None:
+            self._parse_questions()
+        return self._questions_end
+
+    @property
+    def answer_records(self) -> List[DNSResourceRecord]:
+        return self._section(0)
+
+    @property
+    def authoritative_records(self) -> List[DNSResourceRecord]:
+        return self._section(1)
+
+    @property
+    def additional_records(self) -> List[DNSResourceRecord]:
+        return self._section(2)
+
+    # считываем вопросы
+    def _parse_questions(self):
+        questions = []
+        position = _HEADER.size
+        for _ in range(self.header.qd_count):
+            q_name, position = self._parse_name(position)
+            q_type, q_class = _QUESTION.unpack_from(self.data, position)
+            position += _QUESTION.size
+            questions.append(DNSQuestion(q_name, q_type, q_class))
+        self._questions = questions
+        self._questions_end = position
+
+    # считываем секции записей по порядку до нужной включительно
+    def _section(self, index: int) -> List[DNSResourceRecord]:
+        if len(self._sections) <= index:
+            counts = (self.header.an_count, self.header.ns_count, self.header.ar_count)
+            position = self._sections_end or self.questions_end
+            while len(self._sections) <= index:
+                records, position = self._parse_records(position, counts[len(self._sections)])
+                self._sections.append(records)
+            self._sections_end = position
+        return self._sections[index]
+
+    def _parse_records(self, position: int, count: int) -> Tuple[List[DNSResourceRecord], int]:
+        records = []
+        for _ in range(count):
+            r_name, position = self._parse_name(position)
+            r_type, r_class, r_ttl, rd_length = _RECORD.unpack_from(self.data, position)
+            position += _RECORD.size
+            r_data = self._parse_resource_body(position, r_type, rd_length)
+            position += rd_length
+            records.append(DNSResourceRecord(r_name, r_type, r_class, r_ttl, rd_length, r_data))
+        return records, position
+
+    # считываем имя домена, начинающееся по смещению position;
+    # возвращаем имя и смещение сразу за его записью в пакете.
+    # depth — число указателей, по которым уже перешли к этому имени
+    def _parse_name(self, position: int, depth: int = 0) -> Tuple[str, int]:
+        if (cached := self._names.get(position)) is not None:
+            return cached
+
+        data = self.data
+        current = position
+        while 0 < data[current] <= 63:
+            current += data[current] + 1
+        if data[current] == 0:
+            # имя без сжатия берем из общей таблицы имен по его записи в пакете
+            result = name_from_wire(bytes(data[position: current + 1])), current + 1
+        else:
+            # указатель на имя в другом месте пакета: оно тоже попадает в кэш.
+            # Указатель должен вести строго раньше начала имени, иначе имя
+            # может ссылаться само на себя
+            target = ((data[current] & 0x3F) << 8) + data[current + 1]
+            if target >= position or depth >= _MAX_NAME_POINTERS:
+                raise Exception("Invalid name compression pointer")
+            suffix, _ = self._parse_name(target, depth + 1)
+            labels = []
+            label = position
+            while label < current:
+                length = data[label]
+                labels.append(str(self._view[label + 1: label + 1 + length], "cp1251"))
+                label += length + 1
+            if suffix:
+                labels.append(suffix)
+            result = ".".join(labels), current + 2
+
+        self._names[position] = result
+        return result
+
+    # считываем данные записи в зависимости от ее типа
+    def _parse_resource_body(self, position: int, r_type: int, rd_length: int):
+        if r_type == QueryType.A.value:
+            return "%d.%d.%d.%d" % struct.unpack_from("!4B", self.data, position)
+        if r_type in NAME_TYPES:
+            return self._parse_name(position)[0]
+        if r_type == QueryType.SOA.value:
+            m_name, position = self._parse_name(position)
+            r_name, position = self._parse_name(position)
+            return SOAData(m_name, r_name, *_SOA_TIMERS.unpack_from(self.data, position))
+        if r_type == QueryType.AAAA.value:
+            ipv6_address = struct.unpack_from("!8H", self.data, position)
+            return ":".join(hex(octet)[2:] for octet in ipv6_address)
+        if r_type == QueryType.MX.value:
+            (preference,) = _MX_PREFERENCE.unpack_from(self.data, position)
+            return MXData(preference, self._parse_name(position + _MX_PREFERENCE.size)[0])
+        if r_type == QueryType.SRV.value:
+            fields = _SRV_FIELDS.unpack_from(self.data, position)
+            return SRVData(*fields, self._parse_name(position + _SRV_FIELDS.size)[0])
+        if r_type == QueryType.TXT.value:
+            return parse_character_strings(self._view, position, position + rd_length)
+        # данные неизвестных типов и параметры EDNS0 храним как есть
+        return bytes(self._view[position:position + rd_length])
@@ -1,64 +1,230 @@
-import socket
-from typing import List, Optional
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Dict, List, Optional, Tuple
 
 from DNS_server.resources import dependencies
+from DNS_server.resources.metrics import Histogram
 from DNS_server.dns_data import dns_packer
+from DNS_server.dns_data.delegation import Delegation, DelegationCache
+from DNS_server.dns_data.names import canonical_name
+from DNS_server.dns_data.rtt import RttTracker
+from DNS_server.dns_data import upstream
+from DNS_server.dns_data.upstream import PendingQuery, get_tcp_pool, get_upstream_pool
 from DNS_server.dns_data.data import DNSPackage, QueryClass, QueryType
+from DNS_server.dns_data.package_view import DNSPackageView
 
 settings = dependencies.get_server_settings()
 
+Package = DNSPackageView if settings["lazy_parser"] else DNSPackage
 
-# Выполняем рекурсивный запрос к ДНС серверу
+delegations = DelegationCache(settings["delegation_cache_max_entries"])
+servers = RttTracker(settings["upstream_timeout"], settings["rtt_forget_after"])
+# распределение времени ответа вышестоящих серверов для метрик
+upstream_rtt = Histogram()
+
+# Коды ответа, после которых стоит спросить другой сервер зоны
+_RCODE_SERVER_FAILURE = 2
+_RCODE_REFUSED = 5
+
+
+# Ограничение числа запросов к вышестоящим серверам на одно разрешение,
+# общее для разрешения имен NS-серверов
+class _Budget:
+    def __init__(self, queries: int):
+        self.queries = queries
+
+    def take(self) -> bool:
+        self.queries -= 1
+        return self.queries >= 0
+
+
+# Выполняем итеративный запрос: начинаем с ближайшей известной зоны
+# и идем по делегированиям, запоминая их в кэше делегирований
 def resolve(
         q_request: bytes,
-        server_ip: str = settings["root_server_ip"],
-        server_port: int = settings["root_server_port"],
+        server_ip: Optional[str] = None,
+        server_port: Optional[int] = None,
 ) -> Optional[DNSPackage]:
-    response = _ask_dns_server(q_request, server_ip, server_port)
-    response_package = DNSPackage(response)
+    # корневой сервер берем из настроек при каждом разрешении: его можно сменить без перезапуска
+    if server_ip is None:
+        server_ip = settings["root_server_ip"]
+    if server_port is None:
+        server_port = settings["root_server_port"]
+    q_name = canonical_name(Package(q_request).questions[0].q_name)
+    budget = _Budget(settings["resolve_max_queries"])
+    return _resolve(q_request, q_name, server_ip, server_port, budget, 0)
+
+
+# Применяем перечитанные настройки к кэшу делегирований, учету RTT серверов
+# и пулам соединений с ними
+def apply_settings():
+    delegations.resize(settings["delegation_cache_max_entries"])
+    servers.timeout = settings["upstream_timeout"]
+    servers.forget_after = settings["rtt_forget_after"]
+    upstream.apply_settings()
+
+
+def _resolve(
+        q_request: bytes,
+        q_name: str,
+        root_ip: str,
+        server_port: int,
+        budget: _Budget,
+        depth: int,
+) -> Optional[DNSPackage]:
+    delegation = delegations.closest(q_name)
+    if delegation is None:
+        zone, server_ips = "", [root_ip]
+    else:
+        zone = delegation.zone
+        server_ips = _get_server_ips(delegation, root_ip, server_port, budget, depth)
+
+    while server_ips:
+        response_package = _ask_any(q_request, server_ips, server_port, budget)
+        if response_package is None:
+            return None
 
-    # в случае, если есть ответы на вопросы в принятом пакете,
-    # возвращаем полученное сообщение
-    if response_package.header.an_count > 0:
-        return response_package
+        # в случае, если есть ответы на вопросы в принятом пакете,
+        # возвращаем полученное сообщение
+        if response_package.header.an_count > 0:
+            return response_package
 
-    # если присутствуют авторитетные записи,
-    # то разрешаем каждые из этих имен в IP-адреса
-    if response_package.header.ns_count > 0:
-        for ar in response_package.authoritative_records:
-            for ad_r in response_package.additional_records:
-                if ad_r.r_type == QueryType.A:
-                    return resolve(q_request, ad_r.r_data)
+        # отрицательный ответ (ошибка, NXDOMAIN или NODATA с SOA-записью зоны)
+        # тоже окончательный, дальше по делегированиям не идем
+        if response_package.header.flags & 0xF or any(
+                ar.r_type == QueryType.SOA for ar in response_package.authoritative_records
+        ):
+            return response_package
 
-            for ip in _get_ips_by_name(response_package.header.id, ar.r_data):
-                return resolve(q_request, ip)
+        # направление к серверам зоны ниже текущей; направление вверх или в сторону
+        # (неправильно настроенный сервер) привело бы к зацикливанию
+        ns_records = [
+            ar for ar in response_package.authoritative_records if ar.r_type == QueryType.NS
+        ]
+        if not ns_records or not _is_closer(canonical_name(ns_records[0].r_name), zone, q_name):
+            return None
+
+        delegation = delegations.add(ns_records, response_package.additional_records)
+        zone = delegation.zone
+        server_ips = _get_server_ips(delegation, root_ip, server_port, budget, depth)
+
+
+# Адреса серверов зоны: из glue-записей, а если их нет — разрешаем имена серверов
+def _get_server_ips(
+        delegation: Delegation,
+        root_ip: str,
+        server_port: int,
+        budget: _Budget,
+        depth: int,
+) -> List[str]:
+    server_ips = delegation.ips()
+    if server_ips or depth >= settings["resolve_max_depth"]:
+        return server_ips
+
+    for server in delegation.servers:
+        server_ips = _get_ips_by_name(server, root_ip, server_port, budget, depth + 1)
+        if server_ips:
+            delegations.add_addresses(delegation, server, server_ips)
+            return server_ips
+    return []
 
 
 # Пытаемся разрешить через ДНС сервер доменное имя в ip-адрес
 def _get_ips_by_name(
-        r_id: int,
         name: str,
-        server_ip: str = settings["root_server_ip"],
-        server_port: int = settings["root_server_port"],
-) -> Optional[List[str]]:
+        root_ip: str,
+        server_port: int,
+        budget: _Budget,
+        depth: int,
+) -> List[str]:
     q_request = dns_packer.get_request(
-        r_id,
+        0,
         name,
         QueryType.A,
         QueryClass.IN,
+        settings["edns_udp_size"],
     )
 
-    resolver_package = resolve(q_request, server_ip, server_port)
+    resolver_package = _resolve(q_request, name, root_ip, server_port, budget, depth)
+
+    if resolver_package is None:
+        return []
+    return [ra.r_data for ra in resolver_package.answer_records if ra.r_type == QueryType.A]
+
+
+# Спрашиваем серверы зоны, начиная с самых быстрых. Если сервер отвечает дольше
+# обычного (и не меньше upstream_race_delay), параллельно спрашиваем следующий
+# (не больше upstream_race_width одновременно) и берем первый подходящий ответ;
+# опоздавший ответ первого сервера тоже принимается, пока не истек upstream_timeout
+def _ask_any(
+        request: bytes, server_ips: List[str], server_port: int, budget: _Budget
+) -> Optional[DNSPackage]:
+    pool = get_upstream_pool()
+    candidates = servers.rank(server_ips) * (settings["upstream_retries"] + 1)
+    in_flight: Dict[Future, Tuple[str, PendingQuery, float]] = {}
+    next_launch = 0.0
+    fallback = None  # ответ с ошибкой сервера, если лучшего не будет
+    try:
+        while candidates or in_flight:
+            now = time.monotonic()
+            can_launch = candidates and len(in_flight) < settings["upstream_race_width"]
+            if can_launch and (not in_flight or now >= next_launch):
+                if not budget.take():
+                    candidates = []
+                    continue
+                ip = candidates.pop(0)
+                try:
+                    pending = pool.submit(request, ip, server_port)
+                except OSError:
+                    servers.record_failure(ip)
+                    continue
+                in_flight[pending.future] = (ip, pending, now + settings["upstream_timeout"])
+                # следующий сервер спрашиваем, когда этот уже опаздывает
+                next_launch = now + max(settings["upstream_race_delay"], servers.expected(ip) or 0)
+                continue
+
+            # ждем первый ответ, истечение таймаута или время запуска следующего запроса
+            wake = min(deadline for _, _, deadline in in_flight.values())
+            if can_launch:
+                wake = min(wake, next_launch)
+            done, _ = wait(in_flight, max(wake - now, 0), FIRST_COMPLETED)
+            for future in done:
+                ip, pending, _ = in_flight.pop(future)
+                servers.record(ip, pending.rtt)
+                upstream_rtt.observe(pending.rtt)
+                response = future.result()
+                # ответ не поместился в датаграмму: повторяем запрос по TCP
+                if struct.unpack_from("!H", response, 2)[0] & dns_packer.FLAG_TC:
+                    try:
+                        response = get_tcp_pool().query(request, ip, server_port)
+                    except OSError:
+                        servers.record_failure(ip)
+                        continue
+                response_package = Package(response)
+                rcode = response_package.header.flags & 0xF
+                if rcode in (_RCODE_SERVER_FAILURE, _RCODE_REFUSED):
+                    fallback = response_package
+                    continue
+                return response_package
+
+            now = time.monotonic()
+            for future, (ip, pending, deadline) in list(in_flight.items()):
+                if deadline <= now:
+                    del in_flight[future]
+                    pending.cancel()
+                    servers.record_failure(ip)
+    finally:
+        for _, pending, _ in in_flight.values():
+            pending.cancel()
+    return fallback
+
+
+# Зона zone лежит ниже текущей зоны parent и содержит имя q_name
+def _is_closer(zone: str, parent: str, q_name: str) -> bool:
+    return _is_subdomain(zone, parent) and zone != parent and _is_subdomain(q_name, zone)
 
-    if resolver_package is not None:
-        return [ra.r_data for ra in resolver_package.answer_records]
 
+def _is_subdomain(name: str, zone: str) -> bool:
+    return not zone or name == zone or name.endswith("." + zone)
 
-# Отправляем запрос на ДНС сервер и получаем ответ
-def _ask_dns_server(request: bytes, dns_server_ip: str, dns_server_port=53) -> bytes:
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.settimeout(5)
-        sock.connect((dns_server_ip, dns_server_port))
-        sock.settimeout(None)
-        sock.send(request)
-        return sock.recv(settings["request_size"])
@@ -0,0 +1,86 @@
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional
+
+# Оценка времени ответа сервера, о котором еще ничего не известно
+_UNKNOWN_RTT = 0.3
+
+
+# Сглаженное время ответа сервера и число неудач подряд
+@dataclass
+class _ServerInfo:
+    srtt: float
+    rttvar: float
+    failures: int
+    updated: float
+
+
+# Учет времени ответа вышестоящих серверов: сглаженное RTT и его разброс
+# считаются как в TCP (RFC 6298), за неудачи оценка ухудшается. По этим данным
+# серверы упорядочиваются и решается, когда пора спрашивать следующий сервер.
+# Давно не обновлявшиеся сведения забываются, чтобы снова проверить сервер
+class RttTracker:
+    def __init__(self, timeout: float, forget_after: float):
+        self.timeout = timeout
+        self.forget_after = forget_after
+        self._lock = Lock()
+        self._servers: Dict[str, _ServerInfo] = {}
+
+    # Сначала самые быстрые и надежные серверы
+    def rank(self, ips: List[str]) -> List[str]:
+        now = time.time()
+        with self._lock:
+            return sorted(ips, key=lambda ip: self._score(ip, now))
+
+    # За сколько сервер почти наверняка отвечает; None, если о сервере ничего не известно
+    def expected(self, ip: str) -> Optional[float]:
+        with self._lock:
+            info = self._get(ip, time.time())
+        if info is None:
+            return None
+        return info.srtt + 4 * info.rttvar
+
+    def record(self, ip: str, rtt: float):
+        now = time.time()
+        with self._lock:
+            info = self._get(ip, now)
+            if info is None:
+                self._servers[ip] = _ServerInfo(rtt, rtt / 2, 0, now)
+                return
+            info.rttvar += (abs(info.srtt - rtt) - info.rttvar) / 4
+            info.srtt += (rtt - info.srtt) / 8
+            info.failures = 0
+            info.updated = now
+
+    def record_failure(self, ip: str):
+        now = time.time()
+        with self._lock:
+            info = self._get(ip, now)
+            if info is None:
+                self._servers[ip] = _ServerInfo(self.timeout, 0, 1, now)
+                return
+            info.srtt = min(info.srtt * 2, self.timeout)
+            info.failures += 1
+            info.updated = now
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "servers": len(self._servers),
+                "failing": sum(info.failures > 0 for info in self._servers.values()),
+            }
+
+    def _get(self, ip: str, now: float):
+        info = self._servers.get(ip)
+        if info is not None and now - info.updated > self.forget_after:
+            del self._servers[ip]
+            return None
+        return info
+
+    def _score(self, ip: str, now: float) -> float:
+        info = self._get(ip, now)
+        if info is None:
+            return _UNKNOWN_RTT
+        return info.srtt * (1 + info.failures)
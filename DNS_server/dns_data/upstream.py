@@ -0,0 +1,228 @@
+import random
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, List, Optional, Tuple
+
+from DNS_server.resources import dependencies
+
+settings = dependencies.get_server_settings()
+
+_HEADER_SIZE = 12
+
+
+# Запрос, ожидающий ответа от вышестоящего сервера
+class PendingQuery:
+    def __init__(self, pool: "UpstreamPool", key: Tuple[str, int, int], h_id: bytes, question: bytes):
+        self.future: Future = Future()
+        self._pool = pool
+        self._key = key
+        self._h_id = h_id  # исходный id запроса, возвращаем его в ответе
+        self._question = question
+        self.sent = time.monotonic()
+        self.rtt: Optional[float] = None  # время ответа сервера
+
+    # Проверяем, что датаграмма действительно ответ на этот вопрос, а не случайный пакет
+    def _matches(self, response: bytes) -> bool:
+        end = _HEADER_SIZE + len(self._question)
+        return response[_HEADER_SIZE:end].lower() == self._question.lower()
+
+    def _resolve(self, response: bytes):
+        self.rtt = time.monotonic() - self.sent
+        # запрос могли отменить одновременно с приходом ответа
+        try:
+            self.future.set_result(self._h_id + response[2:])
+        except InvalidStateError:
+            pass
+
+    # Перестаем ждать ответ (по таймауту или если ответ уже получен от другого сервера)
+    def cancel(self):
+        self._pool._forget(self._key, self)
+        self.future.cancel()
+
+
+# Пул долгоживущих UDP-сокетов к вышестоящим серверам. Каждый запрос получает
+# случайный id, по паре (адрес сервера, id) ответ находит своего ожидающего,
+# поэтому по одним и тем же сокетам одновременно идет много запросов
+class UpstreamPool:
+    def __init__(self, pool_size: int, recv_size: int):
+        self.recv_size = recv_size  # меняется при перечитывании настроек
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, int, int], PendingQuery] = {}
+        self._sockets: List[socket.socket] = []
+        self._next_socket = 0
+        for _ in range(pool_size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sockets.append(sock)
+            threading.Thread(target=self._receiver, args=(sock,), daemon=True).start()
+
+    # Отправляем запрос, не дожидаясь ответа
+    def submit(self, request: bytes, ip: str, port: int) -> PendingQuery:
+        question = request[_HEADER_SIZE:_question_end(request)]
+        with self._lock:
+            q_id = random.getrandbits(16)
+            while (ip, port, q_id) in self._pending:
+                q_id = random.getrandbits(16)
+            key = (ip, port, q_id)
+            pending = PendingQuery(self, key, request[:2], question)
+            self._pending[key] = pending
+            sock = self._sockets[self._next_socket]
+            self._next_socket = (self._next_socket + 1) % len(self._sockets)
+        try:
+            sock.sendto(struct.pack("!H", q_id) + request[2:], (ip, port))
+        except OSError:
+            pending.cancel()
+            raise
+        return pending
+
+    def _forget(self, key: Tuple[str, int, int], pending: PendingQuery):
+        with self._lock:
+            if self._pending.get(key) is pending:
+                self._pending.pop(key)
+
+    # Принимаем ответы и передаем их ожидающим запросам
+    def _receiver(self, sock: socket.socket):
+        while True:
+            try:
+                response, address = sock.recvfrom(self.recv_size)
+            except OSError:
+                continue
+            if len(response) < _HEADER_SIZE:
+                continue
+            (q_id,) = struct.unpack_from("!H", response)
+            key = (address[0], address[1], q_id)
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None or not pending._matches(response):
+                    continue
+                self._pending.pop(key)
+            pending._resolve(response)
+
+
+# Пул постоянных TCP-соединений к вышестоящим серверам. По TCP повторяем запрос,
+# ответ на который не поместился в датаграмму (флаг TC). После ответа соединение
+# возвращается в пул и используется следующими запросами к тому же серверу
+class TcpUpstreamPool:
+    def __init__(self, timeout: float, max_idle: int):
+        # оба значения меняются при перечитывании настроек
+        self.timeout = timeout
+        self.max_idle = max_idle  # простаивающих соединений на один сервер
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, int], List[socket.socket]] = {}
+        self.connects = 0
+        self.reuses = 0
+
+    def query(self, request: bytes, ip: str, port: int) -> bytes:
+        while True:
+            sock, reused = self._acquire(ip, port)
+            try:
+                response = self._exchange(sock, request)
+            except OSError:
+                sock.close()
+                # сервер мог закрыть простаивавшее соединение, пробуем новое
+                if reused:
+                    continue
+                raise
+            self._release(ip, port, sock)
+            return response
+
+    def _acquire(self, ip: str, port: int) -> Tuple[socket.socket, bool]:
+        with self._lock:
+            idle = self._idle.get((ip, port))
+            if idle:
+                self.reuses += 1
+                return idle.pop(), True
+            self.connects += 1
+        sock = socket.create_connection((ip, port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, False
+
+    def _release(self, ip: str, port: int, sock: socket.socket):
+        with self._lock:
+            idle = self._idle.setdefault((ip, port), [])
+            if len(idle) < self.max_idle:
+                idle.append(sock)
+                return
+        sock.close()
+
+    # Отправляем запрос с длиной в начале (RFC 1035, 4.2.2) и читаем ответ
+    def _exchange(self, sock: socket.socket, request: bytes) -> bytes:
+        q_id = random.getrandbits(16)
+        sock.settimeout(self.timeout)
+        sock.sendall(struct.pack("!HH", len(request), q_id) + request[2:])
+        (length,) = struct.unpack("!H", _recv_exactly(sock, 2))
+        response = _recv_exactly(sock, length)
+        question = request[_HEADER_SIZE:_question_end(request)]
+        end = _HEADER_SIZE + len(question)
+        if (
+                length < _HEADER_SIZE
+                or struct.unpack_from("!H", response)[0] != q_id
+                or response[_HEADER_SIZE:end].lower() != question.lower()
+        ):
+            raise ConnectionError("Unexpected TCP response from DNS server")
+        return request[:2] + response[2:]
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        return {"connects": self.connects, "reuses": self.reuses}
+
+
+# Читаем из потока ровно size байт
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by DNS server")
+        data += chunk
+    return bytes(data)
+
+
+# Находим конец секции вопроса в запросе (имя в запросе не сжато)
+def _question_end(request: bytes) -> int:
+    position = _HEADER_SIZE
+    while request[position] != 0:
+        position += request[position] + 1
+    return position + 5
+
+
+_pool: Optional[UpstreamPool] = None
+_pool_lock = threading.Lock()
+
+
+# Общий пул процесса создаем при первом обращении, чтобы не запускать потоки до fork
+def get_upstream_pool() -> UpstreamPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = UpstreamPool(settings["upstream_pool_size"], _recv_size())
+        return _pool
+
+
+_tcp_pool: Optional[TcpUpstreamPool] = None
+
+
+def get_tcp_pool() -> TcpUpstreamPool:
+    global _tcp_pool
+    with _pool_lock:
+        if _tcp_pool is None:
+            _tcp_pool = TcpUpstreamPool(settings["upstream_timeout"], settings["upstream_tcp_max_idle"])
+        return _tcp_pool
+
+
+# Ответ может занимать весь объявленный серверу размер датаграммы
+def _recv_size() -> int:
+    return max(settings["request_size"], settings["edns_udp_size"])
+
+
+# Применяем перечитанные настройки к уже созданным пулам: после смены edns_udp_size
+# серверам объявляется новый размер датаграммы, и принимать нужно столько же
+def apply_settings():
+    with _pool_lock:
+        if _pool is not None:
+            _pool.recv_size = _recv_size()
+        if _tcp_pool is not None:
+            _tcp_pool.timeout = settings["upstream_timeout"]
+            _tcp_pool.max_idle = settings["upstream_tcp_max_idle"]
@@ -1,9 +1,22 @@
-from server import Server
+from async_server import AsyncServer
+from batch_server import BatchServer
+from server import Server, settings
+from worker_pool import WorkerPool
+
+SERVERS = {
+    "sync": Server,
+    "async": AsyncServer,
+    "batch": BatchServer,
+}
 
 
 def main():
+    server_class = SERVERS[settings["serve_mode"]]
     try:
-        Server().run()
+        if settings["workers"] > 1:
+            WorkerPool(server_class, settings["workers"]).run()
+        else:
+            server_class().run()
     except Exception:
         pass
 
@@ -1,2 +1,6 @@
 from .dependencies import get_server_settings
-from .cacher import Cacher
\ No newline at end of file
+from .cache_store import CacheStore
+from .cacher import Cacher
+from .singleflight import SingleFlight
+from .refresher import Refresher
+from .zone_store import ZoneStore
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import pickle
+import queue
+import struct
+import time
+import zlib
+from threading import Event, Thread
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Файл кэша — последовательность независимых кадров: длина, CRC32 и pickle одной
+# записи. Поэтому файл читается по одной записи, а оборванный при падении
+# последний кадр просто отбрасывается
+_MAGIC = b"DNC1"
+_FRAME_HEADER = struct.Struct("!II")
+
+
+# Хранение кэша на диске: снимок (snapshot) и журнал добавлений (journal).
+# Новые записи дописываются в журнал фоновым потоком, не задерживая обработку
+# запросов. Периодически поток записывает свежий снимок во временный файл,
+# атомарно подменяет им старый и очищает журнал
+class CacheStore:
+    def __init__(
+            self,
+            path: str,
+            snapshot_period: float,
+            journal_max_bytes: int,
+            get_items: Callable[[], List[Tuple[tuple, object]]],
+    ):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self._snapshot_period = snapshot_period
+        self._journal_max_bytes = journal_max_bytes
+        self._get_items = get_items  # текущее содержимое кэша для снимка
+        self._queue: "queue.Queue[Optional[Tuple[tuple, object]]]" = queue.Queue()
+        self._snapshot_requested = Event()
+        self._snapshot_done = Event()
+        self._journal = None
+        self._writer = Thread(target=self._write_loop, daemon=True)
+
+    # Читаем снимок, затем журнал; записи отдаются по одной, по мере чтения
+    def load(self) -> Iterator[Tuple[tuple, object]]:
+        for path in (self.path, self.journal_path):
+            yield from self._read_frames(path)
+
+    def start(self):
+        self._writer.start()
+
+    # Ставим запись в очередь на запись в журнал
+    def append(self, key: tuple, entry: object):
+        self._queue.put((key, entry))
+
+    # Записываем снимок сейчас и ждем окончания записи
+    def snapshot(self, timeout: Optional[float] = None):
+        if not self._writer.is_alive():
+            self._write_snapshot()
+            return
+        self._snapshot_done.clear()
+        self._snapshot_requested.set()
+        self._queue.put(None)  # будим поток записи
+        self._snapshot_done.wait(timeout)
+
+    def _write_loop(self):
+        # после падения в конце журнала может остаться оборванный кадр, поэтому
+        # загруженный кэш сразу сохраняется снимком и журнал начинается заново
+        self._write_snapshot()
+        self._journal = open(self.journal_path, "wb")
+        self._journal.write(_MAGIC)
+        last_snapshot = time.monotonic()
+        while True:
+            # забираем все, что успело накопиться, и пишем одним вызовом
+            items = []
+            try:
+                items.append(self._queue.get(timeout=1))
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            frames = [_pack_frame(item) for item in items if item is not None]
+            if frames:
+                self._journal.write(b"".join(frames))
+                self._journal.flush()
+
+            if (
+                    self._snapshot_requested.is_set()
+                    or time.monotonic() - last_snapshot >= self._snapshot_period
+                    or self._journal.tell() >= self._journal_max_bytes
+            ):
+                self._snapshot_requested.clear()
+                self._write_snapshot()
+                last_snapshot = time.monotonic()
+                self._snapshot_done.set()
+
+    # Снимок пишется во временный файл и атомарно подменяет старый, после чего
+    # журнал очищается: все записи из него уже попали в снимок
+    def _write_snapshot(self):
+        items = self._get_items()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_MAGIC)
+            for item in items:
+                file.write(_pack_frame(item))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+        if self._journal is not None:
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._journal.write(_MAGIC)
+            self._journal.flush()
+
+    @staticmethod
+    def _read_frames(path: str) -> Iterator[Tuple[tuple, object]]:
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            magic = file.read(len(_MAGIC))
+            if not magic:
+                return
+            if magic != _MAGIC:
+                print(f"Unsupported cache format in {path}, skipping it.")
+                return
+            while header := file.read(_FRAME_HEADER.size):
+                if len(header) < _FRAME_HEADER.size:
+                    break
+                length, crc = _FRAME_HEADER.unpack(header)
+                data = file.read(length)
+                # оборванный или поврежденный кадр: дальше данных нет
+                if len(data) < length or zlib.crc32(data) != crc:
+                    print(f"Truncated cache file {path}, loaded what was intact.")
+                    break
+                yield pickle.loads(data)
+
+
+def _pack_frame(item: Tuple[tuple, object]) -> bytes:
+    data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+    return _FRAME_HEADER.pack(len(data), zlib.crc32(data)) + data
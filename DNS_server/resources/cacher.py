@@ -1,96 +1,409 @@
-import os
-import pickle
+import heapq
+import itertools
 import time
-from datetime import datetime
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
 from threading import Lock, Thread
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from DNS_server.dns_data.data import DNSResourceRecord, QueryType
+from DNS_server.dns_data.dns_packer import WireAnswers, pack_answers
+from DNS_server.dns_data.names import canonical_name
+from DNS_server.resources.cache_store import CacheStore
 
+# Код ответа для закэшированной неудачи разрешения (RFC 2308, 7.1)
+RCODE_SERVER_FAILURE = 2
+# Коды ответа вышестоящих серверов, означающие неудачу разрешения: такие ответы
+# кэшируются ненадолго и не отдаются после истечения
+FAILURE_RCODES = (RCODE_SERVER_FAILURE, 5)
 
-# Класс для работы с кэшем
+# Примерный размер служебных объектов записи (ключ, записи, упакованный ответ) в байтах
+_ENTRY_OVERHEAD = 256
+_RECORD_OVERHEAD = 200
+
+
+# Закэшированный ответ на один вопрос
+@dataclass
+class CacheEntry:
+    created: float  # время добавления в кэш
+    expires: float  # время, когда истекает самая короткая TTL записей
+    records: List[DNSResourceRecord]
+    wire: WireAnswers  # записи, упакованные в формат пакета
+    size: int  # примерный объем в памяти
+    authority: List[DNSResourceRecord] = field(default_factory=list)  # SOA отрицательного ответа
+    rcode: int = 0  # код ответа
+    hits: int = 0  # число попаданий, в том числе до обновления записи
+
+    # Отрицательный ответ: имени нет, нет записей нужного типа или разрешение не удалось
+    @property
+    def is_negative(self) -> bool:
+        return not self.records
+
+    # Время жизни записи истекло, но ее еще можно отдавать (serve-stale)
+    def is_stale(self, now: float) -> bool:
+        return now >= self.expires
+
+    # Прошла заданная доля времени жизни популярной записи, пора обновить ее заранее
+    def needs_prefetch(self, now: float, fraction: float, min_hits: int) -> bool:
+        return (
+                self.hits >= min_hits
+                and now >= self.created + fraction * (self.expires - self.created)
+        )
+
+
+# Вытеснение давно не использованных записей
+class _LRUPolicy:
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def add(self, key):
+        self._order[key] = None
+
+    def touch(self, key):
+        self._order.move_to_end(key)
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+# Вытеснение редко используемых записей: ключи разложены по корзинам частот,
+# внутри корзины — в порядке последнего обращения
+class _LFUPolicy:
+    def __init__(self):
+        self._counts: Dict[tuple, int] = {}
+        self._buckets: Dict[int, OrderedDict] = defaultdict(OrderedDict)
+        self._min_count = 0
+
+    def add(self, key):
+        self._counts[key] = 1
+        self._buckets[1][key] = None
+        self._min_count = 1
+
+    def touch(self, key):
+        count = self._counts[key]
+        self._take_from_bucket(key, count)
+        if self._min_count == count and count not in self._buckets:
+            self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets[count + 1][key] = None
+
+    def remove(self, key):
+        count = self._counts.pop(key, None)
+        if count is not None:
+            self._take_from_bucket(key, count)
+
+    def victim(self):
+        if self._min_count not in self._buckets:
+            self._min_count = min(self._buckets)
+        return next(iter(self._buckets[self._min_count]))
+
+    def _take_from_bucket(self, key, count: int):
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+
+_POLICIES = {"lru": _LRUPolicy, "lfu": _LFUPolicy}
+
+_Key = Tuple[str, QueryType]
+
+
+# Хранилище записей с ограничением объема и кучей времен истечения
+class _Store:
+    def __init__(self, max_entries: int, max_bytes: int, policy: str):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0  # текущий примерный объем в байтах
+        self.entries: Dict[_Key, CacheEntry] = {}
+        self._policy = _POLICIES[policy]()
+        self._expiry_heap: List[Tuple[float, int, _Key, CacheEntry]] = []
+        self._sequence = itertools.count()
+        self.evictions = 0
+        self.expirations = 0
+
+    def touch(self, key: _Key):
+        self._policy.touch(key)
+
+    # Вставляем запись, освобождая место заранее, чтобы она не стала первой жертвой LFU;
+    # removed_at — время, после которого запись удаляется окончательно
+    def insert(self, key: _Key, entry: CacheEntry, removed_at: float):
+        if key in self.entries:
+            self.remove(key)
+        self._evict(entry.size)
+        self.entries[key] = entry
+        self._policy.add(key)
+        self.size += entry.size
+        heapq.heappush(self._expiry_heap, (removed_at, next(self._sequence), key, entry))
+
+    def remove(self, key: _Key):
+        entry = self.entries.pop(key)
+        self._policy.remove(key)
+        self.size -= entry.size
+
+    # Достаем из кучи записи, время которых истекло
+    def expire(self, now: float):
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            _, _, key, entry = heapq.heappop(heap)
+            # запись могла быть уже заменена или вытеснена
+            if self.entries.get(key) is entry:
+                self.remove(key)
+                self.expirations += 1
+
+        # вытесненные записи остаются в куче до своего истечения, иногда пересобираем ее
+        if len(heap) > 2 * len(self.entries) + 1024:
+            self._expiry_heap = [item for item in heap if self.entries.get(item[2]) is item[3]]
+            heapq.heapify(self._expiry_heap)
+
+    # Меняем ограничения объема; лишние записи сразу вытесняются
+    def resize(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        while self.entries and (len(self.entries) > max_entries or self.size > max_bytes):
+            self.remove(self._policy.victim())
+            self.evictions += 1
+
+    # Вытесняем записи, пока хранилище вместе с новой записью размера extra не уложится в ограничения
+    def _evict(self, extra: int):
+        while self.entries and (
+                len(self.entries) + 1 > self.max_entries or self.size + extra > self.max_bytes
+        ):
+            self.remove(self._policy.victim())
+            self.evictions += 1
+
+
+# Класс для работы с кэшем. Объем кэша ограничен числом записей и примерным
+# размером в байтах, при переполнении вытесняются записи по политике LRU или LFU.
+# Истекшие записи удаляются по куче времен истечения, поэтому очистка
+# просматривает только истекшие записи, а не весь кэш. Если stale_window > 0,
+# истекшие записи еще stale_window секунд отдаются из кэша (RFC 8767).
+# Отрицательные ответы (RFC 2308) хранятся отдельно и со своими ограничениями,
+# чтобы поток запросов к несуществующим именам не вытеснял обычные записи
 class Cacher:
-    def __init__(self, path, clean_period):
+    def __init__(
+            self,
+            path,
+            clean_period,
+            max_entries,
+            max_bytes,
+            policy="lru",
+            stale_window=0,
+            negative_max_entries=10000,
+            negative_max_bytes=4 * 1024 * 1024,
+            snapshot_period=300,
+            journal_max_bytes=16 * 1024 * 1024,
+    ):
         self.path: str = path
-        self.buffer: Dict[
-            str,
-            Dict[QueryType, Tuple[datetime, List[DNSResourceRecord]]],
-        ] = {}
+        self._store = CacheStore(path, snapshot_period, journal_max_bytes, self._snapshot_items)
+        self.stale_window: float = stale_window
+        self._positive = _Store(max_entries, max_bytes, policy)
+        self._negative = _Store(negative_max_entries, negative_max_bytes, policy)
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
         self.cleaner = Thread(target=self._cleaner, args=(clean_period,), daemon=True)
+        self._warmer = Thread(target=self._warm_up, daemon=True)
         self.lock = Lock()
 
-    # Выгружаем все данные из файла с кэшем
-    def load(self):
-        try:
-            if os.path.getsize(self.path) > 0:
-                with open(self.path, "rb") as file:
-                    self.buffer = pickle.load(file)
-        except FileNotFoundError:
-            open(self.path, "a").close()
-            print(f"Created file {self.path}.")
-
-    # Запускаем поток, который будет очищать кэш
+    # Загружаем кэш с диска по одной записи, пропуская истекшие;
+    # запросы можно обслуживать уже во время загрузки. Снимок читается раньше
+    # журнала, поэтому более поздний кадр заменяет загруженную ранее запись,
+    # а записи, которые успели попасть в кэш во время загрузки, новее
+    # сохраненных и не заменяются
+    def load(self) -> int:
+        loaded_keys = set()
+        now = time.time()
+        for (q_name, q_type), entry in self._store.load():
+            key = (canonical_name(q_name), q_type)
+            with self.lock:
+                if key in loaded_keys:
+                    # запись из журнала заменяет сохраненную в снимке, даже если уже истекла
+                    self._remove(key)
+                    loaded_keys.discard(key)
+                elif key in self._positive.entries or key in self._negative.entries:
+                    continue
+                if self._removed_at(entry) > now:
+                    self._insert(key, entry)
+                    loaded_keys.add(key)
+        return len(loaded_keys)
+
+    # Запускаем потоки, которые будут очищать кэш, загружать его с диска
+    # и записывать на диск. Сервер отвечает сразу, не дожидаясь загрузки
     def start(self):
         self.cleaner.start()
+        self._warmer.start()
+
+    # Меняем ограничения кэша без перезапуска (при перечитывании настроек)
+    def configure(
+            self,
+            max_entries: int,
+            max_bytes: int,
+            negative_max_entries: int,
+            negative_max_bytes: int,
+            stale_window: float,
+    ):
+        with self.lock:
+            self._positive.resize(max_entries, max_bytes)
+            self._negative.resize(negative_max_entries, negative_max_bytes)
+            self.stale_window = stale_window
 
-    # Добавление записей в буфер с кэшем
+    # Добавление записей в кэш
     def add(
             self,
             q_name: str,
             q_type: QueryType,
             answer_records: List[DNSResourceRecord],
     ):
-        if q_name not in self.buffer:
-            self.buffer[q_name] = {}
-        if q_type not in self.buffer[q_name]:
-            self.buffer[q_name][q_type] = datetime.now(), answer_records
+        # запись живет, пока не истечет самая короткая TTL
+        ttl = min((record.r_ttl for record in answer_records), default=0)
+        self._add(q_name, q_type, answer_records, [], 0, ttl)
 
-    # Сохраняем все данные из буфера в файл
+    # Добавление отрицательного ответа: код ответа и SOA-запись зоны, TTL берется из SOA
+    def add_negative(
+            self,
+            q_name: str,
+            q_type: QueryType,
+            rcode: int,
+            authority_records: List[DNSResourceRecord],
+            ttl: int,
+    ):
+        self._add(q_name, q_type, [], authority_records, rcode, ttl)
+
+    # Сохраняем снимок всего кэша в файл (новые записи и так попадают в журнал).
+    # Пока кэш не загружен целиком, снимок потерял бы незагруженные записи
     def save(self):
-        pickle.dump(
-            self.buffer, open(self.path, "wb"), protocol=pickle.HIGHEST_PROTOCOL
-        )
+        if self._warmer.is_alive():
+            self._warmer.join()
+        self._store.snapshot(timeout=10)
 
     # Закрываем кэш
     def close(self):
         self.cleaner.join(1)
 
-    # Получение записей из буфера с кэшем
-    def get(self, q_name: str, q_type: QueryType):
-        if q_name in self.buffer and q_type in self.buffer[q_name]:
-            if self._is_late_records(q_name, q_type):
-                self._clean_buffer(q_name, q_type)
+    # Получение записей из кэша
+    def get(self, q_name: str, q_type: QueryType) -> Optional[CacheEntry]:
+        key = (canonical_name(q_name), q_type)
+        with self.lock:
+            store = self._positive
+            entry = store.entries.get(key)
+            if entry is None:
+                store = self._negative
+                entry = store.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            if self._removed_at(entry) <= now:
+                store.remove(key)
+                store.expirations += 1
+                self.misses += 1
                 return None
-            return self.buffer[q_name][q_type]
+            store.touch(key)
+            entry.hits += 1
+            if entry.is_stale(now):
+                self.stale_hits += 1
+            elif entry.is_negative:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry
+
+    # Счетчики кэша
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self._positive.entries),
+                "bytes": self._positive.size,
+                "negative_entries": len(self._negative.entries),
+                "negative_bytes": self._negative.size,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self._positive.evictions,
+                "negative_evictions": self._negative.evictions,
+                "expirations": self._positive.expirations + self._negative.expirations,
+            }
+
+    # Загружаем кэш с диска и только после этого запускаем запись на диск:
+    # первый снимок должен содержать загруженные записи
+    def _warm_up(self):
+        started = time.monotonic()
+        loaded = self.load()
+        print(f"cache: loaded {loaded} entries in {time.monotonic() - started:.1f} s")
+        self._store.start()
 
     # Удаление истекших записей из кэша
     def _cleaner(self, period):
         while True:
-            items = list(self.buffer.items())
-            for q_name, d in items:
-                keys = list(d.keys())
-                for q_type in keys:
-                    if self._is_late_records(q_name, q_type):
-                        self._clean_buffer(q_name, q_type)
-
+            with self.lock:
+                now = time.time()
+                self._positive.expire(now)
+                self._negative.expire(now)
             time.sleep(period)
 
-    # Очистка буфера
-    def _clean_buffer(self, q_name, q_type):
-        self.lock.acquire()
-
-        self.buffer[q_name].pop(q_type)
-        if len(self.buffer[q_name]) == 0:
-            self.buffer.pop(q_name)
-
-        self.lock.release()
-
-    # Проверка записей на истечение времени хранения в кэше
-    def _is_late_records(self, q_name, q_type) -> bool:
-        t, records = self.buffer[q_name][q_type]
-        dt = (datetime.now() - t).seconds
-        print(dt)
-        for record in records:
-            print(record.r_ttl)
-            if dt >= record.r_ttl:
-                return True
-        return False
+    def _add(
+            self,
+            q_name: str,
+            q_type: QueryType,
+            answer_records: List[DNSResourceRecord],
+            authority_records: List[DNSResourceRecord],
+            rcode: int,
+            ttl: int,
+    ):
+        if ttl <= 0:
+            return
+        now = time.time()
+        wire = pack_answers(q_name, answer_records, authority_records, rcode)
+        size = (
+                _ENTRY_OVERHEAD
+                + len(q_name)
+                + len(wire.data)
+                + _RECORD_OVERHEAD * (len(answer_records) + len(authority_records))
+        )
+        entry = CacheEntry(now, now + ttl, answer_records, wire, size, authority_records, rcode)
+
+        key = (canonical_name(q_name), q_type)
+        with self.lock:
+            # неудача не вытесняет истекшие записи, которые еще можно отдавать (serve-stale)
+            if rcode in FAILURE_RCODES and key in self._positive.entries:
+                return
+            previous = self._positive.entries.get(key) or self._negative.entries.get(key)
+            if previous is not None:
+                # обновленная запись остается такой же популярной
+                entry.hits = previous.hits
+            self._insert(key, entry)
+        self._store.append(key, entry)
+
+    # Содержимое кэша для снимка на диске
+    def _snapshot_items(self) -> List[Tuple[_Key, CacheEntry]]:
+        with self.lock:
+            return [*self._positive.entries.items(), *self._negative.entries.items()]
+
+    # Кладем запись в нужное хранилище, убирая ответ другого вида на тот же вопрос
+    def _insert(self, key: _Key, entry: CacheEntry):
+        store, other = self._positive, self._negative
+        if entry.is_negative:
+            store, other = other, store
+        if entry.size > store.max_bytes:
+            return
+        if key in other.entries:
+            other.remove(key)
+        store.insert(key, entry, self._removed_at(entry))
+
+    # Убираем запись из того хранилища, в котором она лежит
+    def _remove(self, key: _Key):
+        for store in (self._positive, self._negative):
+            if key in store.entries:
+                store.remove(key)
+
+    # Время окончательного удаления записи; неудачи разрешения не отдаются после истечения
+    def _removed_at(self, entry: CacheEntry) -> float:
+        if entry.rcode in FAILURE_RCODES:
+            return entry.expires
+        return entry.expires + self.stale_window
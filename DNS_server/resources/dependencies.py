@@ -1,7 +1,46 @@
 import json
+import os
+from typing import List, Optional
 
+# Файл настроек лежит рядом с модулем, поэтому не зависит от текущей папки;
+# его можно подменить переменной окружения, например для бенчмарков
+CONFIG_PATH = os.environ.get(
+    "DNS_SERVER_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+)
 
-def get_server_settings() -> dict:
-    with open("resources/config.json", "r") as jsonfile:
-        settings = json.load(jsonfile)
-    return settings
+# Настройки-пути к файлам; относительный путь считается от папки файла настроек
+PATH_SETTINGS = ("cache_filepath", "zone_filepath")
+
+
+# Настройки сервера, общие для всех модулей. При перечитывании значения
+# обновляются на месте, поэтому код, который читает settings["key"] при каждом
+# использовании, сразу видит новые значения
+class Settings(dict):
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    # Перечитываем файл; возвращаем имена изменившихся настроек.
+    # Если файл не удалось прочитать, настройки остаются прежними
+    def reload(self) -> List[str]:
+        with open(self.path, "r") as jsonfile:
+            settings = json.load(jsonfile)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        for key in PATH_SETTINGS:
+            if key in settings:
+                settings[key] = os.path.join(directory, settings[key])
+        changed = [key for key, value in settings.items() if self.get(key) != value]
+        self.update(settings)
+        return changed
+
+
+_settings: Optional[Settings] = None
+
+
+# Настройки читаются из файла один раз, при первом обращении
+def get_server_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _settings = Settings(CONFIG_PATH)
+        _settings.reload()
+    return _settings
@@ -0,0 +1,187 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+# Границы корзин гистограмм задержек в секундах: от 10 мкс до 5 с
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# Этапы обработки запроса, время которых измеряется
+STAGES = ("parse", "cache", "pack", "resolve", "send", "total")
+
+
+# Гистограмма с фиксированными корзинами в духе Prometheus. Обновляется без
+# блокировок: при одновременных обновлениях из потоков изредка теряется наблюдение,
+# что для метрик допустимо и дешевле блокировки на каждом запросе
+class Histogram:
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+# Значение, которое может уменьшаться (например, число разрешений в работе)
+class Gauge:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self):
+        with self._lock:
+            self.value += 1
+
+    def dec(self):
+        with self._lock:
+            self.value -= 1
+
+
+# Замер этапов одного запроса: каждый вызов lap записывает время с предыдущего
+class _StageTimer:
+    sampled = True
+
+    def __init__(self, stages: Dict[str, Histogram]):
+        self._stages = stages
+        self._started = self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self._stages[stage].observe(now - self._last)
+        self._last = now
+
+    def finish(self):
+        self._stages["total"].observe(time.perf_counter() - self._started)
+
+
+# Заглушка для запросов, не попавших в выборку: замеры ничего не стоят
+class _NoTimer:
+    sampled = False
+
+    def lap(self, stage: str):
+        pass
+
+    def finish(self):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+# Метрики сервера: счетчики запросов, гистограммы времени этапов обработки
+# (только для каждого n-го запроса, чтобы замеры почти ничего не стоили),
+# гистограммы, которые ведут другие модули, и счетчики их stats()
+class Metrics:
+    def __init__(self, sample_rate: float):
+        self._interval = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self._countdown = self._interval
+        self.udp_queries = 0
+        self.tcp_queries = 0
+        self.local_answers = 0
+        self.in_flight = Gauge()  # разрешения через вышестоящие серверы в работе
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self._histograms: Dict[str, Histogram] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+    # Учитываем запрос по UDP; для запросов из выборки возвращаем замер этапов
+    def start_request(self):
+        self.udp_queries += 1
+        if not self._interval:
+            return _NO_TIMER
+        self._countdown -= 1
+        if self._countdown:
+            return _NO_TIMER
+        self._countdown = self._interval
+        return _StageTimer(self.stages)
+
+    # Гистограмма, которую ведет другой модуль (например, RTT вышестоящих серверов)
+    def add_histogram(self, name: str, histogram: Histogram):
+        self._histograms[name] = histogram
+
+    # Счетчики, которые отдает stats() другого компонента; опрашиваются при выгрузке
+    def add_collector(self, name: str, stats: Callable[[], Dict[str, int]]):
+        self._collectors[name] = stats
+
+    # Метрики в текстовом формате Prometheus
+    def render(self) -> str:
+        lines = []
+        _add_metric(lines, "dns_queries_total", "counter", [
+            ('{transport="udp"}', self.udp_queries),
+            ('{transport="tcp"}', self.tcp_queries),
+        ])
+        _add_metric(lines, "dns_local_answers_total", "counter", [("", self.local_answers)])
+        _add_metric(lines, "dns_in_flight", "gauge", [("", self.in_flight.value)])
+
+        lines.append("# TYPE dns_request_stage_seconds histogram")
+        for stage, histogram in self.stages.items():
+            _add_histogram(lines, "dns_request_stage_seconds", histogram, f'stage="{stage}"')
+        for name, histogram in self._histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            _add_histogram(lines, name, histogram)
+
+        for group, stats in self._collectors.items():
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Unable to collect {group} metrics: {e}")
+                continue
+            for key, value in values.items():
+                _add_metric(lines, f"dns_{group}_{key}", "untyped", [("", value)])
+            if group == "cache" and values.get("hits", 0) + values.get("misses", 0):
+                ratio = values["hits"] / (values["hits"] + values["misses"])
+                _add_metric(lines, "dns_cache_hit_ratio", "gauge", [("", round(ratio, 6))])
+        return "\n".join(lines) + "\n"
+
+
+def _add_metric(lines: List[str], name: str, kind: str, samples: List[Tuple[str, float]]):
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+
+
+# Корзины гистограммы выгружаются накопительно, как принято в Prometheus
+def _add_histogram(lines: List[str], name: str, histogram: Histogram, labels: str = ""):
+    prefix = f"{labels}," if labels else ""
+    total = 0
+    for bound, count in zip((*histogram.bounds, "+Inf"), list(histogram.counts)):
+        total += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {total}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {total}")
+
+
+# Локальный HTTP-сервер, отдающий метрики по адресу /metrics
+class MetricsEndpoint:
+    def __init__(self, metrics: Metrics, ip: str, port: int):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # запросы к метрикам не пишем в журнал
+            def log_message(self, *args):
+                pass
+
+        self._http_server = ThreadingHTTPServer((ip, port), Handler)
+        self._http_server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
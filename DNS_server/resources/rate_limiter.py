@@ -0,0 +1,124 @@
+import ipaddress
+import random
+import socket
+import time
+from array import array
+from typing import Dict, Hashable, List, Optional
+
+from DNS_server.dns_data.names import canonical_name
+
+# Код ответа «отказано»: клиент исчерпал бюджет обращений к вышестоящим серверам
+RCODE_REFUSED = 5
+
+# Что делать с ответом по UDP
+SEND = 0  # отправить как есть
+DROP = 1  # не отправлять
+SLIP = 2  # отправить обрезанным (с флагом TC), чтобы клиент повторил запрос по TCP
+
+
+# Таблица корзин токенов фиксированного размера: ключ хэшируется в одну из ячеек,
+# поэтому память не растет при флуде с подделанных адресов — разные ключи просто
+# делят ячейку. Хэш смешивается со случайной солью, чтобы нельзя было заранее
+# подобрать адреса, попадающие в ячейку чужого клиента. Гонки между потоками
+# допустимы: они лишь немного смещают счетчики
+class TokenBuckets:
+    def __init__(self, size: int, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._size = size
+        self._salt = random.getrandbits(64)
+        self._tokens = array("d", [burst]) * size
+        self._updated = array("d", [0.0]) * size
+
+    # Забираем токен из корзины ключа; False, если корзина пуста
+    def take(self, key: Hashable, now: float) -> bool:
+        slot = hash((self._salt, key)) % self._size
+        buckets, updated = self._tokens, self._updated
+        tokens = buckets[slot] + (now - updated[slot]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        updated[slot] = now
+        if tokens < 1:
+            buckets[slot] = tokens
+            return False
+        buckets[slot] = tokens - 1
+        return True
+
+
+# Ограничения для клиентов по UDP, общие для сети клиента (префикса длины prefix_length):
+# частота запросов, частота промахов кэша (каждый промах — обход вышестоящих серверов)
+# и частота одинаковых ответов (RRL), которая защищает от использования сервера
+# для усиления отраженных атак. Адреса из exempt не ограничиваются
+class RateLimiter:
+    def __init__(
+            self,
+            enabled: bool,
+            table_size: int,
+            prefix_length: int,
+            query_rate: float,
+            query_burst: float,
+            miss_rate: float,
+            miss_burst: float,
+            response_rate: float,
+            slip: int,
+            exempt: List[str],
+    ):
+        self._enabled = enabled
+        self._shift = 32 - prefix_length
+        self._exempt = [
+            (int(network.network_address), int(network.netmask))
+            for network in map(ipaddress.IPv4Network, exempt)
+        ]
+        self._queries = TokenBuckets(table_size, query_rate, query_burst)
+        self._misses = TokenBuckets(table_size, miss_rate, miss_burst)
+        self._responses = TokenBuckets(table_size, response_rate, response_rate)
+        self._slip = slip
+        self.dropped_queries = 0
+        self.refused_misses = 0
+        self.dropped_responses = 0
+        self.slipped_responses = 0
+
+    # Ключ сети клиента; None, если клиента не ограничиваем
+    def client_key(self, ip: str) -> Optional[int]:
+        if not self._enabled:
+            return None
+        address = int.from_bytes(socket.inet_aton(ip), "big")
+        for network, netmask in self._exempt:
+            if address & netmask == network:
+                return None
+        return address >> self._shift
+
+    def allow_query(self, client: Optional[int]) -> bool:
+        if client is None or self._queries.take(client, time.monotonic()):
+            return True
+        self.dropped_queries += 1
+        return False
+
+    def allow_miss(self, client: Optional[int]) -> bool:
+        if client is None or self._misses.take(client, time.monotonic()):
+            return True
+        self.refused_misses += 1
+        return False
+
+    # Решаем судьбу ответа: одинаковыми считаются ответы одной сети клиента
+    # на один и тот же вопрос с одним и тем же кодом ответа. Из ответов сверх
+    # лимита каждый slip-й отправляется обрезанным, остальные отбрасываются
+    def response_action(self, client: Optional[int], q_name: str, q_type: int, rcode: int) -> int:
+        if client is None or self._responses.take(
+                (client, canonical_name(q_name), q_type, rcode), time.monotonic()
+        ):
+            return SEND
+        self.dropped_responses += 1
+        if self._slip and self.dropped_responses % self._slip == 0:
+            self.slipped_responses += 1
+            return SLIP
+        return DROP
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        return {
+            "dropped_queries": self.dropped_queries,
+            "refused_misses": self.refused_misses,
+            "dropped_responses": self.dropped_responses - self.slipped_responses,
+            "slipped_responses": self.slipped_responses,
+        }
@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Hashable, Set
+
+
+# Фоновое обновление записей кэша: заранее для популярных записей (prefetch)
+# и для истекших записей, которые пока отдаются клиентам (serve-stale)
+class Refresher:
+    def __init__(self, workers: int, retry_interval: float):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._retry_interval = retry_interval
+        self._lock = Lock()
+        self._running: Set[Hashable] = set()
+        self._failed: Dict[Hashable, float] = {}  # время последней неудачной попытки
+        self._next_prune = 0.0
+        self.started = 0
+        self.failures = 0
+
+    # Запускаем обновление, если по этому ключу оно еще не идет
+    # и недавняя попытка не закончилась ошибкой (не нагружаем недоступный сервер)
+    def schedule(self, key: Hashable, fn: Callable[[], object]):
+        now = time.time()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            if key in self._running:
+                return
+            if now - self._failed.get(key, 0) < self._retry_interval:
+                return
+            self._running.add(key)
+            self.started += 1
+        self._executor.submit(self._run, key, fn)
+
+    def _run(self, key: Hashable, fn: Callable[[], object]):
+        try:
+            fn()
+        except Exception as e:
+            print(e)
+            with self._lock:
+                self._failed[key] = time.time()
+                self.failures += 1
+        else:
+            with self._lock:
+                self._failed.pop(key, None)
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+    # Забываем неудачи старше retry_interval: они уже не задерживают обновление,
+    # а ключи, которые больше не запрашивают, иначе копились бы бесконечно
+    def _prune(self, now: float):
+        self._failed = {
+            key: failed for key, failed in self._failed.items()
+            if now - failed < self._retry_interval
+        }
+        self._next_prune = now + self._retry_interval
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        return {"started": self.started, "failures": self.failures}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
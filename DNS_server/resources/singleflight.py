@@ -0,0 +1,44 @@
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+# Объединение одинаковых запросов: пока по ключу идет разрешение,
+# остальные запросы с тем же ключом ждут его результат, а не повторяют работу
+class SingleFlight:
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.leaders = 0  # запросы, которые действительно выполнили работу
+        self.shared = 0  # запросы, получившие чужой результат (сэкономленные обращения)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key)
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "shared": self.shared}
@@ -0,0 +1,338 @@
+import dataclasses
+import math
+import socket
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from DNS_server.dns_data.data import (
+    NAME_TYPES,
+    DNSResourceRecord,
+    MXData,
+    QueryClass,
+    QueryType,
+    SOAData,
+    SRVData,
+)
+from DNS_server.dns_data.dns_packer import pack_answers
+from DNS_server.dns_data.names import canonical_name
+from DNS_server.resources.cacher import CacheEntry
+
+# Код ответа «имени не существует»
+_RCODE_NAME_ERROR = 3
+# Сколько CNAME подряд проходим внутри локальных зон
+_MAX_CNAME_CHAIN = 8
+# Сколько ответов для имен, которых нет в зонах явно (шаблоны, NXDOMAIN, NODATA), запоминаем
+_SYNTHESIZED_MAX_ENTRIES = 10000
+# TTL записей, если в файле зоны до них не было ни $TTL, ни TTL у записей
+_DEFAULT_TTL = 3600
+
+_Node = Dict[int, List[DNSResourceRecord]]
+
+
+# Скомпилированные локальные зоны: записи разложены по каноническим именам
+# (в нижнем регистре, без точки в конце) и типам, ответы на вопросы о существующих
+# именах и типах заранее упакованы. Записи индекса не меняются после построения,
+# поэтому его можно читать из любых потоков без блокировок
+class _ZoneIndex:
+    def __init__(self, records: List[DNSResourceRecord]):
+        # вершины зон и их SOA-записи
+        self.zones: Dict[str, DNSResourceRecord] = {
+            canonical_name(record.r_name): record
+            for record in records
+            if record.r_type == QueryType.SOA
+        }
+        # записи по именам; промежуточные имена без записей тоже существуют (RFC 4592)
+        self.nodes: Dict[str, _Node] = {}
+        for record in records:
+            name = canonical_name(record.r_name)
+            apex = self.find_zone(name)
+            if apex is None:
+                raise ValueError(f"{record.r_name} is outside of any zone with SOA record")
+            self.nodes.setdefault(name, {}).setdefault(record.r_type, []).append(record)
+            while name != apex:
+                name = name.partition(".")[2]
+                self.nodes.setdefault(name, {})
+
+        self.answers: Dict[Tuple[str, int], CacheEntry] = {
+            (name, r_type): self.compile(name, r_type)
+            for name, node in self.nodes.items()
+            if not name.startswith("*")
+            for r_type in node
+        }
+        # ответы, собранные при запросах; при переполнении просто очищаются
+        self.synthesized: Dict[Tuple[str, int], CacheEntry] = {}
+
+    # Вершина ближайшей зоны, в которую входит имя
+    def find_zone(self, name: str) -> Optional[str]:
+        while name not in self.zones:
+            if not name:
+                return None
+            name = name.partition(".")[2]
+        return name
+
+    # Собираем ответ на вопрос об имени из локальной зоны: записи нужного типа
+    # (с переходом по CNAME внутри локальных зон), NODATA или NXDOMAIN с SOA зоны
+    def compile(self, q_name: str, q_type: int) -> CacheEntry:
+        name = canonical_name(q_name)
+        apex = self.find_zone(name)
+        owner = q_name
+        records = []
+        for _ in range(_MAX_CNAME_CHAIN):
+            node, synthesized = self._find_node(name, apex)
+            if node is None:
+                if records:
+                    break
+                return self._negative(q_name, apex, _RCODE_NAME_ERROR)
+
+            found = node.get(q_type) or node.get(QueryType.CNAME)
+            if found is None:
+                if records:
+                    break
+                return self._negative(q_name, apex, 0)
+            if synthesized:
+                found = [dataclasses.replace(record, r_name=owner) for record in found]
+            records += found
+            if found[0].r_type == q_type:
+                break
+
+            # ищем цель CNAME, если она тоже в локальной зоне
+            owner = found[0].r_data
+            name = canonical_name(owner)
+            apex = self.find_zone(name)
+            if apex is None:
+                break
+        return CacheEntry(0, math.inf, records, pack_answers(q_name, records), 0)
+
+    # Записи имени; если имени нет — записи подходящего шаблона (*), синтезированные
+    # для этого имени. Шаблон применяется только к несуществующим именам (RFC 4592)
+    def _find_node(self, name: str, apex: str) -> Tuple[Optional[_Node], bool]:
+        node = self.nodes.get(name)
+        if node is not None:
+            return node, False
+        encloser = name
+        while encloser != apex:
+            encloser = encloser.partition(".")[2]
+            if encloser in self.nodes:
+                break
+        return self.nodes.get(f"*.{encloser}" if encloser else "*"), True
+
+    # Отрицательный ответ с SOA зоны, TTL которой ограничен полем minimum (RFC 2308, 3)
+    def _negative(self, q_name: str, apex: str, rcode: int) -> CacheEntry:
+        soa = self.zones[apex]
+        soa = dataclasses.replace(soa, r_ttl=min(soa.r_ttl, soa.r_data.minimum))
+        return CacheEntry(0, math.inf, [], pack_answers(q_name, [], [soa], rcode), 0, [soa], rcode)
+
+
+# Локальные зоны, на которые сервер отвечает сам, не обращаясь к кэшу и вышестоящим
+# серверам. Зоны читаются из файла в формате мастер-файла (RFC 1035, 5) и
+# заменяются целиком: при перезагрузке новый индекс строится в стороне, а при
+# ошибке в файле продолжают работать прежние зоны
+class ZoneStore:
+    def __init__(self, path: str):
+        self._path = path
+        self._index = _ZoneIndex([])
+
+    # Загружаем (или перезагружаем) зоны из файла, при необходимости из нового;
+    # False, если файл не удалось разобрать
+    def load(self, path: Optional[str] = None) -> bool:
+        if path is not None:
+            self._path = path
+        try:
+            with open(self._path, "r", encoding="utf-8") as zone_file:
+                index = _ZoneIndex(list(parse_zone_file(zone_file.read())))
+        except FileNotFoundError:
+            index = _ZoneIndex([])
+        except (OSError, ValueError) as e:
+            print(f"Unable to load zones from {self._path}: {e}")
+            return False
+        self._index = index
+        return True
+
+    # Ответ из локальной зоны; None, если имя не входит ни в одну локальную зону
+    def lookup(self, q_name: str, q_type: int) -> Optional[CacheEntry]:
+        index = self._index
+        if not index.zones:
+            return None
+        name = canonical_name(q_name)
+        key = (name, q_type)
+        compiled = index.answers.get(key) or index.synthesized.get(key)
+        if compiled is None:
+            if index.find_zone(name) is None:
+                return None
+            compiled = index.compile(name, q_type)
+            if len(index.synthesized) >= _SYNTHESIZED_MAX_ENTRIES:
+                index.synthesized.clear()
+            index.synthesized[key] = compiled
+        # записи локальных зон не стареют: TTL в ответе всегда исходный
+        return CacheEntry(
+            time.time(),
+            math.inf,
+            compiled.records,
+            compiled.wire,
+            0,
+            compiled.authority,
+            compiled.rcode,
+        )
+
+    # Счетчики для отладки и метрик
+    def stats(self) -> Dict[str, int]:
+        index = self._index
+        return {"zones": len(index.zones), "names": len(index.nodes)}
+
+
+# Разбираем текст мастер-файла: поддерживаются $ORIGIN, $TTL, @, относительные имена,
+# пропущенное имя владельца, скобки и комментарии. Данные типов, которые сервер
+# не разбирает сам, записываются в общем виде TYPEnnn \# длина hex (RFC 3597, 5)
+def parse_zone_file(text: str) -> Iterator[DNSResourceRecord]:
+    origin = None
+    default_ttl = None
+    last_ttl = _DEFAULT_TTL
+    owner = None
+    for number, owner_omitted, tokens in _read_entries(text):
+        try:
+            keyword = tokens[0].upper()
+            if keyword == "$ORIGIN":
+                origin = _absolute_name(tokens[1], origin)
+                continue
+            if keyword == "$TTL":
+                default_ttl = int(tokens[1])
+                continue
+            if keyword.startswith("$"):
+                raise ValueError(f"unsupported directive {tokens[0]}")
+
+            if not owner_omitted:
+                owner = _absolute_name(tokens.pop(0), origin)
+            elif owner is None:
+                raise ValueError("record without owner name")
+
+            ttl = None
+            while tokens[0].isdigit() or tokens[0].upper() in ("IN", "CH", "HS"):
+                token = tokens.pop(0)
+                if token.isdigit():
+                    ttl = int(token)
+                elif token.upper() != "IN":
+                    raise ValueError(f"unsupported class {token}")
+            # без TTL у записи и без $TTL берем TTL предыдущей записи
+            if ttl is None:
+                ttl = default_ttl if default_ttl is not None else last_ttl
+            last_ttl = ttl
+
+            r_type = _parse_type(tokens.pop(0))
+            r_data = _parse_r_data(r_type, tokens, origin)
+        except (IndexError, TypeError, ValueError, OSError) as e:
+            raise ValueError(f"line {number}: {e or 'incomplete record'}") from None
+        yield DNSResourceRecord(owner, r_type, QueryClass.IN.value, ttl, 0, r_data)
+
+
+# Логические строки файла: номер первой строки, пропущено ли имя владельца
+# (строка начинается с пробела) и слова записи. Комментарии отбрасываются,
+# строки внутри скобок склеиваются
+def _read_entries(text: str) -> Iterator[Tuple[int, bool, List[str]]]:
+    tokens, depth = [], 0
+    start, owner_omitted = 0, False
+    for number, line in enumerate(text.splitlines(), 1):
+        if depth == 0:
+            start, owner_omitted = number, line[:1] in (" ", "\t")
+        depth = _split_line(line, depth, tokens, number)
+        if depth == 0 and tokens:
+            yield start, owner_omitted, tokens
+            tokens = []
+    if depth:
+        raise ValueError(f"line {start}: unbalanced parentheses")
+
+
+# Дописываем в tokens слова строки; возвращаем глубину вложенности скобок после нее
+def _split_line(line: str, depth: int, tokens: List[str], number: int) -> int:
+    position = 0
+    while position < len(line):
+        char = line[position]
+        if char == ";":
+            break
+        if char in " \t":
+            position += 1
+        elif char in "()":
+            depth += 1 if char == "(" else -1
+            if depth < 0:
+                raise ValueError(f"line {number}: unbalanced parentheses")
+            position += 1
+        elif char == '"':
+            # строка в кавычках: пробелы и «;» внутри нее — часть значения
+            value = []
+            position += 1
+            while position < len(line) and line[position] != '"':
+                if line[position] == "\\":
+                    position += 1
+                value.append(line[position:position + 1])
+                position += 1
+            if position >= len(line):
+                raise ValueError(f"line {number}: unterminated string")
+            tokens.append("".join(value))
+            position += 1
+        else:
+            end = position
+            while end < len(line) and line[end] not in ' \t;()"':
+                end += 1
+            tokens.append(line[position:end])
+            position = end
+    return depth
+
+
+# Абсолютное имя без точки в конце: @ — текущий $ORIGIN, к относительным именам он дописывается
+def _absolute_name(name: str, origin: Optional[str]) -> str:
+    if name == "@":
+        if origin is None:
+            raise ValueError("@ used before $ORIGIN")
+        return origin
+    if name.endswith("."):
+        return name[:-1]
+    if origin is None:
+        raise ValueError(f"relative name {name} used before $ORIGIN")
+    return f"{name}.{origin}" if origin else name
+
+
+def _parse_type(token: str) -> int:
+    name = token.upper()
+    if name in QueryType.__members__ and name != "OPT":
+        return QueryType[name].value
+    if name.startswith("TYPE") and name[4:].isdigit():
+        return int(name[4:])
+    raise ValueError(f"unsupported record type {token}")
+
+
+# Данные записи в том виде, в котором их возвращают разборщики пакетов
+def _parse_r_data(r_type: int, tokens: List[str], origin: Optional[str]):
+    if tokens and tokens[0] == "\\#":
+        # общий вид данных: длина и шестнадцатеричные байты
+        r_data = bytes.fromhex("".join(tokens[2:]))
+        if len(r_data) != int(tokens[1]):
+            raise ValueError("rdata length does not match")
+        if any(r_type == known for known in QueryType):
+            raise ValueError(f"use native syntax for {QueryType(r_type).name} records")
+        return r_data
+    if r_type == QueryType.A.value:
+        (address,) = tokens
+        return socket.inet_ntoa(socket.inet_aton(address))
+    if r_type == QueryType.AAAA.value:
+        (address,) = tokens
+        socket.inet_pton(socket.AF_INET6, address)
+        return address
+    if r_type in NAME_TYPES:
+        (name,) = tokens
+        return _absolute_name(name, origin)
+    if r_type == QueryType.SOA.value:
+        m_name, r_name, *timers = tokens
+        return SOAData(
+            _absolute_name(m_name, origin), _absolute_name(r_name, origin), *map(int, timers)
+        )
+    if r_type == QueryType.MX.value:
+        preference, exchange = tokens
+        return MXData(int(preference), _absolute_name(exchange, origin))
+    if r_type == QueryType.SRV.value:
+        priority, weight, port, target = tokens
+        return SRVData(int(priority), int(weight), int(port), _absolute_name(target, origin))
+    if r_type == QueryType.TXT.value:
+        strings = [token.encode() for token in tokens]
+        if not strings or any(len(string) > 255 for string in strings):
+            raise ValueError("TXT record needs strings of at most 255 bytes")
+        return strings
+    raise ValueError(f"record type {r_type} requires \\# rdata syntax")
@@ -1,78 +1,492 @@
+import dataclasses
+import random
 import signal
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from resources.cacher import Cacher
+from resources.cacher import FAILURE_RCODES, RCODE_SERVER_FAILURE, CacheEntry, Cacher
+from resources.metrics import Metrics, MetricsEndpoint
+from resources.rate_limiter import DROP, RCODE_REFUSED, SLIP, RateLimiter
+from resources.refresher import Refresher
+from resources.singleflight import SingleFlight
+from resources.zone_store import ZoneStore
 from dns_data import dns_packer, resolver_name
-from dns_data.data import DNSPackage
-from resources import dependencies
+from dns_data.data import DNSPackage, QueryType
+from dns_data.names import canonical_name
+from dns_data.package_view import DNSPackageView
+# объект настроек общий с модулями пакета DNS_server, поэтому импортируем его оттуда
+from DNS_server.dns_data import upstream
+from DNS_server.resources import dependencies
+from tcp_server import TcpListener
 
 settings = dependencies.get_server_settings()
 
 
+# Параметры кэша из настроек
+def get_cacher_args() -> tuple:
+    return (
+        settings["cache_filepath"],
+        settings["clean_period"],
+        settings["cache_max_entries"],
+        settings["cache_max_bytes"],
+        settings["cache_policy"],
+        settings["stale_window"] if settings["serve_stale"] else 0,
+        settings["negative_cache_max_entries"],
+        settings["negative_cache_max_bytes"],
+        settings["snapshot_period"],
+        settings["journal_max_bytes"],
+    )
+
+
+# Ограничения кэша, которые меняются без перезапуска
+def get_cache_limits() -> tuple:
+    return (
+        settings["cache_max_entries"],
+        settings["cache_max_bytes"],
+        settings["negative_cache_max_entries"],
+        settings["negative_cache_max_bytes"],
+        settings["stale_window"] if settings["serve_stale"] else 0,
+    )
+
+
+# Параметры ограничений частоты запросов из настроек
+def get_rate_limiter_args() -> tuple:
+    return (
+        settings["rate_limit_enabled"],
+        settings["rate_limit_table_size"],
+        settings["rate_limit_prefix_length"],
+        settings["rate_limit_qps"],
+        settings["rate_limit_burst"],
+        settings["miss_rate_limit_qps"],
+        settings["miss_rate_limit_burst"],
+        settings["rrl_responses_per_second"],
+        settings["rrl_slip"],
+        settings["rate_limit_exempt"],
+    )
+
+
+# Настройки, которые читаются только при запуске: сокеты, пулы потоков и процессов,
+# файлы кэша. После их изменения в файле сервер нужно перезапустить
+RESTART_SETTINGS = (
+    "server_ip",
+    "server_port",
+    "serve_mode",
+    "workers",
+    "request_size",
+    "batch_size",
+    "max_in_flight",
+    "lazy_parser",
+    "tcp_enabled",
+    "tcp_workers",
+    "cache_filepath",
+    "cache_policy",
+    "clean_period",
+    "snapshot_period",
+    "journal_max_bytes",
+    "prefetch_workers",
+    "upstream_pool_size",
+    "metrics_enabled",
+    "metrics_ip",
+    "metrics_port",
+    "metrics_sample_rate",
+)
+
+# разбираем запросы лениво (только заголовок и вопросы) или целиком
+Package = DNSPackageView if settings["lazy_parser"] else DNSPackage
+
+
 class Server:
-    def __init__(self):
+    def __init__(self, cacher: Optional[Cacher] = None, reuse_port: bool = False, worker: int = 0):
         # подключаемся к сокету, который будем прослушивать
         self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # несколько процессов могут слушать один порт, ядро распределяет между ними датаграммы
+            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._server_socket.bind((settings["server_ip"], settings["server_port"]))
-        self._init_cacher()
+        # кэш, переданный извне (например, общий для пула процессов), сохраняет его владелец
+        self._owns_cacher = cacher is None
+        if self._owns_cacher:
+            self._init_cacher()
+        else:
+            self._cacher = cacher
+        # локальные зоны, на которые отвечаем сами; перечитываются по SIGHUP вместе с настройками
+        self._zones = ZoneStore(settings["zone_filepath"])
+        self._zones.load()
+        # ограничения частоты запросов, промахов и одинаковых ответов для клиентов по UDP
+        self._limiter = RateLimiter(*get_rate_limiter_args())
+        # одинаковые промахи кэша, пришедшие одновременно, разрешаем один раз
+        self._flights = SingleFlight()
+        # популярные и истекшие записи кэша обновляем в фоне
+        self._refresher = Refresher(settings["prefetch_workers"], settings["stale_retry_interval"])
+        # остальные промахи запроса с несколькими вопросами разрешаются параллельно с первым
+        self._question_executor = ThreadPoolExecutor(
+            max_workers=settings["max_in_flight"], thread_name_prefix="question"
+        )
+        # тот же порт по TCP: для ответов, не поместившихся в датаграмму
+        self._tcp_listener = None
+        if settings["tcp_enabled"]:
+            self._tcp_listener = TcpListener(self._process_request, reuse_port)
+            self._tcp_listener.start()
+        self._init_metrics(worker)
         self._handle_flag = True
         signal.signal(signal.SIGINT, self._close)
+        signal.signal(signal.SIGHUP, self._reload)
 
     def _init_cacher(self):
-        # создаем кэш
-        self._cacher = Cacher(settings["cache_filepath"], settings["clean_period"])
-        self._cacher.load()
+        # создаем кэш; сохраненные записи загружаются в фоне, пока сервер уже отвечает
+        self._cacher = Cacher(*get_cacher_args())
         self._cacher.start()
 
+    # Счетчики и гистограммы сервера; у каждого воркера пула свой порт метрик
+    def _init_metrics(self, worker: int):
+        self._metrics = Metrics(settings["metrics_sample_rate"])
+        self._metrics.add_histogram("dns_upstream_rtt_seconds", resolver_name.upstream_rtt)
+        self._metrics.add_collector("cache", self._cacher.stats)
+        self._metrics.add_collector("zones", self._zones.stats)
+        # ограничитель пересоздается при перечитывании настроек
+        self._metrics.add_collector("rate_limits", lambda: self._limiter.stats())
+        self._metrics.add_collector("singleflight", self._flights.stats)
+        self._metrics.add_collector("refresh", self._refresher.stats)
+        self._metrics.add_collector("delegations", resolver_name.delegations.stats)
+        self._metrics.add_collector("upstream_tcp", lambda: upstream.get_tcp_pool().stats())
+        self._metrics.add_collector("upstreams", resolver_name.servers.stats)
+        self._metrics_endpoint = None
+        if settings["metrics_enabled"]:
+            port = settings["metrics_port"] + worker
+            try:
+                self._metrics_endpoint = MetricsEndpoint(self._metrics, settings["metrics_ip"], port)
+            except OSError as e:
+                print(f"Unable to serve metrics on port {port}: {e}")
+                return
+            self._metrics_endpoint.start()
+
     def run(self):
         # получаем запросы от клиента
         while self._handle_flag:
             request, address = self._server_socket.recvfrom(settings["request_size"])
             self._handle_client(request, address)
 
-    # Обрабатываем запросы клиента
+    # Обрабатываем запросы клиента; неверный запрос не должен останавливать сервер
     def _handle_client(self, request: bytes, address: str):
-        request_package = DNSPackage(request)
+        timer = self._metrics.start_request()
+        client = self._limiter.client_key(address[0])
+        if not self._limiter.allow_query(client):
+            return
+        try:
+            request_package = Package(request)
+            timer.lap("parse")
+            cached = self._lookup_cache(request_package)
+            timer.lap("cache")
+            response = self._get_cached_response(request_package, cached)
+            if response is None:
+                response = self._refuse_miss(request_package, cached, client)
+                if response is None:
+                    response = self._build_response(request_package, cached)
+                timer.lap("resolve")
+            else:
+                timer.lap("pack")
+            # дополнительная секция запроса разбирается только здесь, при поиске OPT
+            response = self._udp_response(request_package, response, client)
+        except Exception as e:
+            print(e)
+            return
+        if response is not None:
+            self._server_socket.sendto(response, address)
+            timer.lap("send")
+        timer.finish()
+
+    # Если для ответа нужно обращаться к вышестоящим серверам, а клиент исчерпал
+    # бюджет промахов кэша, сразу отвечаем REFUSED
+    def _refuse_miss(
+            self, request_package: DNSPackage, cached: List[Optional[CacheEntry]], client
+    ) -> Optional[bytes]:
+        if all(cached_info is not None for cached_info in cached):
+            return None
+        if self._limiter.allow_miss(client):
+            return None
+        return dns_packer.get_response(
+            request_package.header, request_package.questions, [], [], RCODE_REFUSED
+        )
+
+    # Ответ для отправки по UDP с учетом ограничения одинаковых ответов (RRL);
+    # None, если ответ нужно отбросить
+    def _udp_response(self, request_package: DNSPackage, response: bytes, client) -> Optional[bytes]:
+        if client is not None and request_package.questions:
+            question = request_package.questions[0]
+            action = self._limiter.response_action(
+                client, question.q_name, question.q_type, response[3] & 0xF
+            )
+            if action == DROP:
+                return None
+            if action == SLIP:
+                return dns_packer.truncate_response(response, 0)
+        return self._fit_datagram(request_package, response)
+
+    # Ответ по UDP не длиннее, чем принимает клиент: udp_max_response_size без EDNS0,
+    # иначе объявленный клиентом размер (но не больше edns_udp_size).
+    # Не поместившийся ответ обрезаем с флагом TC
+    @staticmethod
+    def _fit_datagram(request_package: DNSPackage, response: bytes) -> bytes:
+        udp_size = dns_packer.get_edns_udp_size(request_package)
+        if udp_size is None:
+            return dns_packer.truncate_response(response, settings["udp_max_response_size"])
+        udp_size = min(udp_size, settings["edns_udp_size"])
+        response = dns_packer.truncate_response(response, udp_size - dns_packer.OPT_SIZE)
+        return dns_packer.add_edns(response, settings["edns_udp_size"])
 
-        total_a_records = []
+    # Формируем ответ на запрос клиента, полученный по TCP (без ограничения размера)
+    def _process_request(self, request: bytes) -> bytes:
+        self._metrics.tcp_queries += 1
+        request_package = Package(request)
+        response = self._build_response(request_package, self._lookup_cache(request_package))
+        if dns_packer.get_edns_udp_size(request_package) is not None:
+            response = dns_packer.add_edns(response, settings["edns_udp_size"])
+        return response
 
+    # Ищем ответы на все вопросы запроса в локальных зонах, затем в кэше; истекающие
+    # записи популярных имен и уже истекшие записи отправляем на фоновое обновление
+    def _lookup_cache(self, request_package: DNSPackage) -> List[Optional[CacheEntry]]:
+        cached = []
+        now = time.time()
         for question in request_package.questions:
-            q_request = dns_packer.get_request(
-                request_package.header.id,
+            local = self._zones.lookup(question.q_name, question.q_type)
+            if local is not None:
+                self._metrics.local_answers += 1
+                cached.append(local)
+                continue
+            cached_info = self._cacher.get(question.q_name, question.q_type)
+            if cached_info is not None and (
+                    cached_info.is_stale(now)
+                    or cached_info.needs_prefetch(
+                        now, settings["prefetch_fraction"], settings["prefetch_min_hits"]
+                    )
+            ):
+                self._schedule_refresh(question)
+            cached.append(cached_info)
+        return cached
+
+    # Обновляем запись кэша, не задерживая ответ клиенту. Ответ SERVFAIL или REFUSED
+    # считаем неудачей обновления, чтобы следующая попытка ждала stale_retry_interval
+    def _schedule_refresh(self, question):
+        key = (canonical_name(question.q_name), question.q_type, question.q_class)
+        q_request = dns_packer.get_request(
+            random.getrandbits(16),
+            question.q_name,
+            question.q_type,
+            question.q_class,
+            settings["edns_udp_size"],
+        )
+
+        def refresh():
+            _, _, rcode = self._flights.do(
+                key, lambda: self._resolve_question(question.q_name, question.q_type, q_request)
+            )
+            if rcode in FAILURE_RCODES:
+                raise Exception(f"Unable to refresh {question.q_name}: rcode {rcode}")
+
+        self._refresher.schedule(key, refresh)
+
+    # Собираем ответ: вопросы, которых нет в кэше, разрешаем через вышестоящие серверы
+    # одновременно, поэтому запрос с несколькими вопросами ждет только самый долгий.
+    # Неразрешенные вопросы пропускаем; если не разрешился ни один, отвечаем ошибкой
+    def _build_response(
+            self, request_package: DNSPackage, cached: List[Optional[CacheEntry]]
+    ) -> bytes:
+        if (response := self._get_cached_response(request_package, cached)) is not None:
+            return response
+
+        now = time.time()
+        answers = [
+            None if cached_info is None else self._cached_answer(cached_info, now)
+            for cached_info in cached
+        ]
+        misses = [i for i, cached_info in enumerate(cached) if cached_info is None]
+        # первый промах разрешаем в текущем потоке, остальные — в пуле
+        futures = [
+            self._question_executor.submit(
+                self._resolve_miss, request_package.header.id, request_package.questions[i]
+            )
+            for i in misses[1:]
+        ]
+        answers[misses[0]] = self._resolve_miss(
+            request_package.header.id, request_package.questions[misses[0]]
+        )
+        for i, future in zip(misses[1:], futures):
+            answers[i] = future.result()
+        return self._assemble_response(request_package, answers)
+
+    # Разрешаем вопрос, которого нет в кэше; None, если разрешить не удалось
+    def _resolve_miss(self, r_id: int, question) -> Optional[tuple]:
+        q_request = dns_packer.get_request(
+            r_id,
+            question.q_name,
+            question.q_type,
+            question.q_class,
+            settings["edns_udp_size"],
+        )
+        try:
+            return self._flights.do(
+                (canonical_name(question.q_name), question.q_type, question.q_class),
+                lambda: self._resolve_question(question.q_name, question.q_type, q_request),
+            )
+        except Exception as e:
+            print(e)
+            # неудачу ненадолго запоминаем, чтобы не повторять обход на каждый запрос
+            self._cacher.add_negative(
                 question.q_name,
                 question.q_type,
-                question.q_class,
+                RCODE_SERVER_FAILURE,
+                [],
+                settings["failure_ttl"],
             )
-            # проверяем, есть ли такой запрос уже в кэше
-            if (
-                    cached_info := self._cacher.get(question.q_name, question.q_type)
-            ) is None:
-                # если запроса нет, то пытаемся получить ответ от днс сервера, пересылая ему запрос
-                try:
-                    answer = resolver_name.resolve(q_request=q_request)
-                except Exception as e:
-                    print(e)
-                    response = dns_packer.get_unsupported_response(q_request[:2])
-                    self._server_socket.sendto(response, address)
-                    return
-
-                a_records = answer.answer_records
-                self._cacher.add(question.q_name, question.q_type, a_records)
-            # иначе достаем запрос из кэша
-            else:
-                print("from cache")
-                _, a_records = cached_info
+            return None
 
-            total_a_records += a_records
+    # Записи ответа, записи полномочий и код ответа из кэша. TTL уменьшаем на время,
+    # прошедшее с добавления в кэш, как и в get_cached_response; истекшие записи
+    # отдаем с TTL stale_answer_ttl, запомненную неудачу разрешения — как None
+    @staticmethod
+    def _cached_answer(cached_info: CacheEntry, now: float) -> Optional[tuple]:
+        if cached_info.rcode == RCODE_SERVER_FAILURE:
+            return None
+        a_records, q_authority = cached_info.records, cached_info.authority
+        elapsed = int(now - cached_info.created)
+        min_ttl = settings["stale_answer_ttl"] if cached_info.is_stale(now) else 0
+        if elapsed > 0 or min_ttl:
+            a_records = [
+                dataclasses.replace(r, r_ttl=max(r.r_ttl - elapsed, min_ttl)) for r in a_records
+            ]
+            q_authority = [
+                dataclasses.replace(r, r_ttl=max(r.r_ttl - elapsed, min_ttl)) for r in q_authority
+            ]
+        return a_records, q_authority, cached_info.rcode
 
-        response = dns_packer.get_response(
-            request_package.header, request_package.questions, total_a_records
+    # Собираем ответ за один проход из ответов на отдельные вопросы (None — вопрос
+    # не разрешился). Код ответа и SOA отрицательного ответа передаем, только если вопрос один.
+    # Если не разрешился ни один вопрос, отвечаем SERVFAIL с вопросами запроса,
+    # и для новой неудачи, и для запомненной в кэше
+    @staticmethod
+    def _assemble_response(request_package: DNSPackage, answers: List[Optional[tuple]]) -> bytes:
+        resolved = [answer for answer in answers if answer is not None]
+        if answers and not resolved:
+            return dns_packer.get_response(
+                request_package.header, request_package.questions, [], [], RCODE_SERVER_FAILURE
+            )
+        authority_records, rcode = [], 0
+        if len(answers) == 1:
+            _, authority_records, rcode = resolved[0]
+        return dns_packer.get_combined_response(
+            request_package.header,
+            request_package.questions,
+            [a_records for a_records, _, _ in resolved],
+            authority_records,
+            rcode,
         )
-        self._server_socket.sendto(response, address)
+
+    # Разрешаем вопрос через вышестоящие серверы и кладем ответ в кэш.
+    # Возвращаем записи ответа, записи полномочий и код ответа
+    def _resolve_question(self, q_name: str, q_type, q_request: bytes) -> tuple:
+        self._metrics.in_flight.inc()
+        try:
+            answer = resolver_name.resolve(q_request=q_request)
+        finally:
+            self._metrics.in_flight.dec()
+        if answer is None:
+            raise Exception(f"Unable to resolve {q_name}")
+
+        if answer.answer_records:
+            self._cacher.add(q_name, q_type, answer.answer_records)
+            return answer.answer_records, [], 0
+
+        rcode = answer.header.flags & 0xF
+        if rcode in FAILURE_RCODES:
+            # все серверы ответили SERVFAIL или REFUSED: запоминаем неудачу, как и при
+            # исключении, чтобы запросы сломанного имени не обходили серверы каждый раз
+            self._cacher.add_negative(q_name, q_type, rcode, [], settings["failure_ttl"])
+            return [], [], rcode
+
+        # отрицательный ответ кэшируем на время из SOA-записи зоны (RFC 2308, 5)
+        soa = next(
+            (ar for ar in answer.authoritative_records if ar.r_type == QueryType.SOA), None
+        )
+        if soa is None:
+            return [], [], rcode
+        ttl = min(soa.r_ttl, soa.r_data.minimum, settings["negative_max_ttl"])
+        authority_records = [dataclasses.replace(soa, r_ttl=ttl)]
+        self._cacher.add_negative(q_name, q_type, rcode, authority_records, ttl)
+        return [], authority_records, rcode
+
+    # Собираем ответ только из кэша, если в нем есть ответы на все вопросы
+    def _get_cached_response(
+            self, request_package: DNSPackage, cached: List[Optional[CacheEntry]]
+    ) -> Optional[bytes]:
+        if any(cached_info is None for cached_info in cached):
+            return None
+
+        # запрос с одним вопросом собираем из уже упакованных записей;
+        # указатели сжатия в них рассчитаны на вопрос без сжатия
+        now = time.time()
+        if (
+                len(cached) == 1
+                and cached[0].rcode != RCODE_SERVER_FAILURE
+                and cached[0].wire.questions_end == request_package.questions_end
+        ):
+            return dns_packer.get_cached_response(
+                request_package.data,
+                request_package.questions_end,
+                cached[0].wire,
+                int(now - cached[0].created),
+                settings["stale_answer_ttl"] if cached[0].is_stale(now) else 0,
+            )
+
+        return self._assemble_response(
+            request_package, [self._cached_answer(cached_info, now) for cached_info in cached]
+        )
+
+    # Перечитываем настройки и зоны в фоне, чтобы не задерживать обработку запросов.
+    # Сокет и кэш остаются прежними, новые значения действуют со следующего запроса
+    def _reload(self, _, __):
+        threading.Thread(target=self._reload_settings, daemon=True).start()
+
+    def _reload_settings(self):
+        try:
+            changed = settings.reload()
+        except (OSError, ValueError) as e:
+            print(f"Unable to reload settings: {e}")
+            changed = []
+        if changed:
+            print(f"settings changed: {', '.join(changed)}")
+        restart = [key for key in changed if key in RESTART_SETTINGS]
+        if restart:
+            print(f"restart the server to apply: {', '.join(restart)}")
+        if any(key.startswith(("rate_limit", "miss_rate_limit", "rrl_")) for key in changed):
+            self._limiter = RateLimiter(*get_rate_limiter_args())
+        if self._owns_cacher:
+            self._cacher.configure(*get_cache_limits())
+        resolver_name.apply_settings()
+        # новые зоны подменяют старые целиком
+        if self._zones.load(settings["zone_filepath"]):
+            print(f"zones: {self._zones.stats()}")
 
     # Останавливаем работу сервера
     def _close(self, _, __):
         self._handle_flag = False
         self._server_socket.close()
-        self._cacher.save()
-        self._cacher.close()
+        if self._tcp_listener is not None:
+            self._tcp_listener.close()
+        if self._metrics_endpoint is not None:
+            self._metrics_endpoint.close()
+        print(f"singleflight: {self._flights.stats()}")
+        print(f"refresh: {self._refresher.stats()}")
+        print(f"delegations: {resolver_name.delegations.stats()}")
+        print(f"upstreams: {resolver_name.servers.stats()}")
+        print(f"upstream tcp: {upstream.get_tcp_pool().stats()}")
+        print(f"rate limits: {self._limiter.stats()}")
+        self._refresher.close()
+        self._question_executor.shutdown(wait=False, cancel_futures=True)
+        if self._owns_cacher:
+            print(f"cache: {self._cacher.stats()}")
+            self._cacher.save()
+            self._cacher.close()
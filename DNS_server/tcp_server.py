@@ -0,0 +1,124 @@
+import socket
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Optional, Set
+
+from DNS_server.resources import dependencies
+
+settings = dependencies.get_server_settings()
+
+_LENGTH = struct.Struct("!H")
+
+
+# Прием запросов по TCP на том же порту, что и UDP (RFC 7766). Сообщения
+# передаются с длиной в начале; клиент может отправить несколько запросов подряд,
+# не дожидаясь ответов (pipelining): они обрабатываются параллельно, ответы
+# отправляются по мере готовности. Простаивающие соединения закрываются
+class TcpListener:
+    def __init__(self, handler: Callable[[bytes], bytes], reuse_port: bool = False):
+        self._handler = handler
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._socket.bind((settings["server_ip"], settings["server_port"]))
+        self._socket.listen(socket.SOMAXCONN)
+        self._executor = ThreadPoolExecutor(max_workers=settings["tcp_workers"])
+        self._lock = threading.Lock()
+        self._connections: Set[socket.socket] = set()
+        self._closed = False
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._socket.close()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                continue
+            with self._lock:
+                if len(self._connections) >= settings["tcp_max_connections"]:
+                    connection.close()
+                    continue
+                self._connections.add(connection)
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    # Читаем запросы соединения, пока клиент его не закроет или не замолчит
+    def _serve_connection(self, connection: socket.socket):
+        connection.settimeout(settings["tcp_idle_timeout"])
+        write_lock = threading.Lock()
+        # незавершенные ответы; колбэки убирают их из набора в потоках пула
+        pending: Set[Future] = set()
+        pending_lock = threading.Lock()
+
+        def forget(done: Future):
+            with pending_lock:
+                pending.discard(done)
+
+        try:
+            while True:
+                try:
+                    header = _recv_exactly(connection, _LENGTH.size)
+                except socket.timeout:
+                    # соединение простаивает, только если все ответы уже отправлены
+                    if pending:
+                        continue
+                    break
+                if header is None:
+                    break
+                (length,) = _LENGTH.unpack(header)
+                request = _recv_exactly(connection, length)
+                if request is None:
+                    break
+                future = self._executor.submit(self._answer, connection, write_lock, request)
+                with pending_lock:
+                    pending.add(future)
+                future.add_done_callback(forget)
+        except (OSError, RuntimeError):
+            pass
+        finally:
+            with pending_lock:
+                unanswered = list(pending)
+            wait(unanswered, settings["tcp_idle_timeout"])
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _answer(self, connection: socket.socket, write_lock: threading.Lock, request: bytes):
+        try:
+            response = self._handler(request)
+        except Exception as e:
+            print(e)
+            return
+        with write_lock:
+            try:
+                connection.sendall(_LENGTH.pack(len(response)) + response)
+            except OSError:
+                pass
+
+
+# Читаем из потока ровно size байт; None, если соединение закрыто или оборвалось
+# посреди сообщения. Таймаут до начала сообщения передаем вызывающему
+def _recv_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    data = bytearray()
+    while len(data) < size:
+        try:
+            chunk = connection.recv(size - len(data))
+        except socket.timeout:
+            if data:
+                return None
+            raise
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
@@ -0,0 +1,104 @@
+import os
+import signal
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+from typing import List, Type
+
+from resources.cacher import Cacher
+from server import Server, get_cache_limits, get_cacher_args, settings
+
+
+# Процесс-владелец кэша: воркеры обращаются к одному экземпляру Cacher через прокси
+class _CacheManager(BaseManager):
+    pass
+
+
+_CacheManager.register("Cacher", Cacher)
+
+# Сигналы, которые главный процесс пересылает воркерам
+_FORWARDED_SIGNALS = {signal.SIGINT, signal.SIGHUP}
+
+
+# Владелец кэша не должен завершаться по Ctrl+C раньше, чем кэш будет сохранен
+def _ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Владельцу кэша SIGHUP не нужен: новые ограничения кэша передает главный процесс
+def _init_cache_owner():
+    _ignore_sigint()
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _FORWARDED_SIGNALS)
+
+
+# Точка входа процесса-воркера. Сигналы унаследованы заблокированными вместе
+# с обработчиками главного процесса; принимаем их, когда сервер поставил свои
+def _run_worker(server_class: Type[Server], cacher, worker: int):
+    server = server_class(cacher=cacher, reuse_port=True, worker=worker)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _FORWARDED_SIGNALS)
+    try:
+        server.run()
+    except OSError:
+        # сокет закрыт обработчиком SIGINT во время ожидания запроса
+        pass
+    finally:
+        # повторный SIGINT (от терминала и от главного процесса) не должен прерывать выход
+        _ignore_sigint()
+
+
+# Пул процессов, каждый из которых слушает один и тот же адрес через SO_REUSEPORT
+class WorkerPool:
+    def __init__(self, server_class: Type[Server], workers: int):
+        self._server_class = server_class
+        self._workers = workers
+        self._processes: List[Process] = []
+        self._manager = _CacheManager()
+        self._cacher = None
+
+    def run(self):
+        # пока запускаются процессы, SIGINT и SIGHUP откладываем: иначе SIGHUP
+        # с действием по умолчанию завершил бы главный процесс, оставив воркеры
+        # без присмотра. Отложенные сигналы придут, когда все воркеры запущены
+        signal.signal(signal.SIGINT, self._stop_workers)
+        signal.signal(signal.SIGHUP, self._reload_workers)
+        signal.pthread_sigmask(signal.SIG_BLOCK, _FORWARDED_SIGNALS)
+        try:
+            self._manager.start(_init_cache_owner)
+            # сохраненный кэш загружается в фоне, воркеры отвечают сразу
+            cacher = self._cacher = self._manager.Cacher(*get_cacher_args())
+            cacher.start()
+
+            self._processes = [
+                Process(target=_run_worker, args=(self._server_class, cacher, worker), daemon=True)
+                for worker in range(self._workers)
+            ]
+            for process in self._processes:
+                process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _FORWARDED_SIGNALS)
+
+        # сохраняем кэш только после того, как все воркеры остановились
+        for process in self._processes:
+            process.join()
+        print(f"cache: {cacher.stats()}")
+        cacher.save()
+        cacher.close()
+        self._manager.shutdown()
+
+    # Пересылаем SIGINT воркерам, если сигнал пришел только главному процессу
+    def _stop_workers(self, _, __):
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+
+    # Настройки и зоны загружены в каждом воркере, поэтому SIGHUP пересылаем им всем;
+    # ограничения общего кэша меняем здесь
+    def _reload_workers(self, _, __):
+        try:
+            settings.reload()
+            self._cacher.configure(*get_cache_limits())
+        except (OSError, ValueError) as e:
+            print(f"Unable to reload settings: {e}")
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
@@ -0,0 +1,153 @@
+# Нагрузочный тест SNTP-сервера: для каждого режима serve_mode и числа воркеров
+# запускает сервер с временными настройками, клиенты держат по window запросов
+# в полете и считают ответы в секунду и задержку ответа (p50/p99/p999).
+# Запуск из корня репозитория:
+#   python SNTP_server/benchmarks/bench_sntp.py --modes select,blocking,epoll --workers 1,2
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from struct import Struct
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUEST = Struct(">BBBBII4sQQQQ")
+ORIGINATE = Struct(">Q")
+TIMEOUT = 0.5
+
+
+def write_config(directory: str, args, mode: str, workers: int) -> str:
+    with open(os.path.join(ROOT, "config.json"), "r") as jsonfile:
+        config = json.load(jsonfile)
+    config.update(server_ip="127.0.0.1", server_port=args.port, serve_mode=mode, workers=workers)
+    path = os.path.join(directory, f"config-{mode}-{workers}.json")
+    with open(path, "w") as jsonfile:
+        json.dump(config, jsonfile, indent=2)
+    return path
+
+
+def request(number: int) -> bytes:
+    return REQUEST.pack(0 << 6 | 4 << 3 | 3, 0, 0, 0, 0, 0, b'', 0, 0, 0, number)
+
+
+def wait_ready(address) -> bool:
+    deadline = time.monotonic() + 10
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.2)
+        while time.monotonic() < deadline:
+            sock.sendto(request(0), address)
+            try:
+                sock.recv(1024)
+                return True
+            except (socket.timeout, ConnectionRefusedError):
+                continue
+    return False
+
+
+def client(address, window: int, duration: float, results):
+    latencies = []
+    lost = 0
+    sent = {}
+    number = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(TIMEOUT)
+
+        def send():
+            nonlocal number
+            number += 1
+            sent[number] = time.perf_counter()
+            sock.sendto(request(number), address)
+
+        deadline = time.perf_counter() + duration
+        for _ in range(window):
+            send()
+        while time.perf_counter() < deadline:
+            try:
+                response = sock.recv(1024)
+            except socket.timeout:
+                lost += len(sent)
+                sent.clear()
+                for _ in range(window):
+                    send()
+                continue
+            # сервер возвращает время отправки запроса в поле originate
+            started = sent.pop(ORIGINATE.unpack_from(response, 24)[0], None)
+            if started is not None:
+                latencies.append(time.perf_counter() - started)
+            send()
+    results.put((latencies, lost))
+
+
+def percentile(values, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0.0
+
+
+def run_load(address, clients: int, window: int, duration: float) -> dict:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=client, args=(address, window, duration, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    latencies = sorted(latency for client_latencies, _ in totals for latency in client_latencies)
+    return {
+        "rps": len(latencies) / duration,
+        "lost": sum(lost for _, lost in totals),
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "p999": percentile(latencies, 0.999),
+    }
+
+
+def bench(directory: str, args, mode: str, workers: int):
+    env = dict(os.environ, SNTP_SERVER_CONFIG=write_config(directory, args, mode, workers))
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], env=env)
+    address = ("127.0.0.1", args.port)
+    try:
+        if not wait_ready(address):
+            print(f"{mode}: server did not start")
+            return None
+        return run_load(address, args.clients, args.window, args.duration)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SNTP server load benchmark")
+    parser.add_argument("--modes", default="select,blocking,epoll")
+    parser.add_argument("--workers", default="1")
+    parser.add_argument("--port", type=int, default=12123)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--window", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'workers':>8}{'replies/s':>11}{'lost':>8}"
+          f"{'p50, ms':>10}{'p99, ms':>10}{'p999, ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in map(int, args.workers.split(",")):
+            for mode in args.modes.split(","):
+                stats = bench(directory, args, mode, workers)
+                if stats is None:
+                    continue
+                print(f"{mode:<10}{workers:>8}{stats['rps']:>11.0f}{stats['lost']:>8}"
+                      f"{stats['p50']:>10.3f}{stats['p99']:>10.3f}{stats['p999']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
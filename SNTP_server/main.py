@@ -1,9 +1,9 @@
-from sntp_server.sntp_verver import SNTPServer
+from sntp_server.sntp_verver import serve
 
 
 def main():
     try:
-        SNTPServer().run()
+        serve()
     except Exception:
         pass
 
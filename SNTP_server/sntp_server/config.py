@@ -1,7 +1,10 @@
 import json
+import os
+
+CONFIG_PATH = os.environ.get("SNTP_SERVER_CONFIG", "SNTP_server/config.json")
 
 
 def get_server_config() -> dict:
-    with open("SNTP_server/config.json", "r") as jsonfile:
+    with open(CONFIG_PATH, "r") as jsonfile:
         settings = json.load(jsonfile)
     return settings
@@ -1,7 +1,9 @@
+import os
+import select
 import signal
 import socket
-import select
-from struct import pack, unpack
+from multiprocessing import Process
+from struct import Struct
 from time import time
 from .config import get_server_config
 
@@ -13,36 +15,82 @@ HEAD_FORMAT = ">BBBBII4sQQQQ"
 UTC_OFFSET = 2208988800
 MODE = 4
 
+HEAD = Struct(HEAD_FORMAT)
+TIMESTAMPS = Struct(">QQQ")
+TRANSMIT_TIMESTAMP = Struct(">Q")
+TIMESTAMPS_OFFSET = 24
+TRANSMIT_OFFSET = 40
+MAX_BATCH = 64
+
 
 class SNTPServer:
-    def __init__(self):
+    def __init__(self, reuse_port: bool = False):
         self._stratum = SETTINGS["stratum"]
         self._leap_indicator = SETTINGS["leap_indicator"]
         self._version_number = SETTINGS["version_number"]
         self._offset = SETTINGS["offset"]
-        self._socket = self._create_and_bind_socket(SETTINGS["server_ip"], SETTINGS["server_port"])
+        self._serve_mode = SETTINGS["serve_mode"]
+        self._socket = self._create_and_bind_socket(
+            SETTINGS["server_ip"], SETTINGS["server_port"], reuse_port
+        )
+        self._request = bytearray(BUFFER_SIZE)
+        self._response = bytearray(HEAD.size)
+        HEAD.pack_into(
+            self._response, 0,
+            self._leap_indicator << 6 | self._version_number << 3 | MODE,
+            self._stratum,
+            0, 0, 0, 0, b'', 0, 0, 0, 0
+        )
         self._is_running = False
         signal.signal(signal.SIGINT, self._shutdown_server)
 
     def run(self):
         self._is_running = True
+        serve = {
+            "select": self._serve_select,
+            "blocking": self._serve_blocking,
+            "epoll": self._serve_epoll,
+        }[self._serve_mode]
+        try:
+            serve()
+        except OSError:
+            if self._is_running:
+                raise
+
+    def _serve_select(self):
         while self._is_running:
             if self._is_socket_ready():
-                request, addr = self._socket.recvfrom(BUFFER_SIZE)
-                response = self._process_request(request)
-                self._socket.sendto(response, addr)
+                self._handle_request()
+
+    def _serve_blocking(self):
+        while self._is_running:
+            self._handle_request()
+
+    def _serve_epoll(self):
+        self._socket.setblocking(False)
+        with select.epoll() as epoll:
+            epoll.register(self._socket.fileno(), select.EPOLLIN)
+            while self._is_running:
+                if not epoll.poll(1):
+                    continue
+                try:
+                    for _ in range(MAX_BATCH):
+                        self._handle_request()
+                except BlockingIOError:
+                    pass
 
-    def _process_request(self, request: bytes) -> bytes:
-        transmit_timestamp = self._extract_transmit_timestamp(request)
+    def _handle_request(self):
+        size, addr = self._socket.recvfrom_into(self._request)
         receive_timestamp = self._get_current_ntp_time()
-        return self._create_response(transmit_timestamp, receive_timestamp)
+        if size < HEAD.size:
+            return
+        transmit_timestamp, = TRANSMIT_TIMESTAMP.unpack_from(self._request, TRANSMIT_OFFSET)
+        self._create_response(transmit_timestamp, receive_timestamp)
+        self._socket.sendto(self._response, addr)
 
-    def _create_response(self, transmit_timestamp, receive_timestamp) -> bytes:
-        return pack(
-            HEAD_FORMAT,
-            self._leap_indicator << 6 | self._version_number << 3 | MODE,
-            self._stratum,
-            0, 0, 0, 0, b'', 0,
+    def _create_response(self, transmit_timestamp: int, receive_timestamp: int):
+        TIMESTAMPS.pack_into(
+            self._response, TIMESTAMPS_OFFSET,
             transmit_timestamp,
             receive_timestamp,
             self._get_current_ntp_time()
@@ -61,11 +109,32 @@ class SNTPServer:
         self._socket.close()
 
     @staticmethod
-    def _extract_transmit_timestamp(request: bytes) -> int:
-        return unpack(HEAD_FORMAT, request)[10]
-
-    @staticmethod
-    def _create_and_bind_socket(ip: str, port: int) -> socket.socket:
+    def _create_and_bind_socket(ip: str, port: int, reuse_port: bool) -> socket.socket:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind((ip, port))
         return sock
+
+
+def serve():
+    workers = SETTINGS["workers"]
+    if workers <= 1:
+        SNTPServer().run()
+        return
+    processes = [Process(target=_run_worker, daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGINT, lambda _, __: _stop_workers(processes))
+    for process in processes:
+        process.join()
+
+
+def _run_worker():
+    SNTPServer(reuse_port=True).run()
+
+
+def _stop_workers(processes):
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGINT)